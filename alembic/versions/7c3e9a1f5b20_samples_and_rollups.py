@@ -0,0 +1,73 @@
+"""telemetry samples and rollups
+
+Revision ID: 7c3e9a1f5b20
+Revises: 46a8e1495442
+Create Date: 2026-10-19 09:12:41.208315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e9a1f5b20'
+down_revision: Union[str, None] = '46a8e1495442'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('telemetry_samples',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('vehicle_id', sa.String(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('rpm', sa.Integer(), nullable=False),
+    sa.Column('speed', sa.Integer(), nullable=True),
+    sa.Column('temp', sa.Integer(), nullable=False),
+    sa.Column('dtc_code', sa.String(), nullable=True),
+    sa.Column('tps_percent', sa.Float(), nullable=True),
+    sa.Column('batt_volt', sa.Float(), nullable=True),
+    sa.Column('fuel_trim_short', sa.Float(), nullable=True),
+    sa.Column('o2_volt', sa.Float(), nullable=True),
+    sa.Column('map_kpa', sa.Float(), nullable=True),
+    sa.Column('vehicle_model', sa.String(), nullable=True),
+    sa.Column('status', sa.JSON(), nullable=False),
+    sa.Column('ai_advice', sa.JSON(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_telemetry_samples_vehicle_id_timestamp', 'telemetry_samples', ['vehicle_id', 'timestamp'], unique=False)
+
+    op.create_table('telemetry_rollups',
+    sa.Column('vehicle_id', sa.String(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('sample_count', sa.Integer(), nullable=False),
+    sa.Column('temp_min', sa.Float(), nullable=True),
+    sa.Column('temp_max', sa.Float(), nullable=True),
+    sa.Column('temp_sum', sa.Float(), nullable=False),
+    sa.Column('rpm_min', sa.Float(), nullable=True),
+    sa.Column('rpm_max', sa.Float(), nullable=True),
+    sa.Column('rpm_sum', sa.Float(), nullable=False),
+    sa.Column('batt_volt_min', sa.Float(), nullable=True),
+    sa.Column('batt_volt_max', sa.Float(), nullable=True),
+    sa.Column('batt_volt_sum', sa.Float(), nullable=False),
+    sa.Column('batt_volt_count', sa.Integer(), nullable=False),
+    sa.Column('count_normal', sa.Integer(), nullable=False),
+    sa.Column('count_overheat', sa.Integer(), nullable=False),
+    sa.Column('count_overspeed', sa.Integer(), nullable=False),
+    sa.Column('count_low_battery', sa.Integer(), nullable=False),
+    sa.Column('count_idle_tps_error', sa.Integer(), nullable=False),
+    sa.Column('count_afr_issue', sa.Integer(), nullable=False),
+    sa.Column('count_critical', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('vehicle_id', 'bucket', 'bucket_start')
+    )
+    op.create_index('ix_telemetry_rollups_bucket_start', 'telemetry_rollups', ['bucket', 'bucket_start'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_telemetry_rollups_bucket_start', table_name='telemetry_rollups')
+    op.drop_table('telemetry_rollups')
+    op.drop_index('ix_telemetry_samples_vehicle_id_timestamp', table_name='telemetry_samples')
+    op.drop_table('telemetry_samples')
@@ -0,0 +1,41 @@
+"""fleet health scores
+
+Revision ID: b4d2f6e8a913
+Revises: 7c3e9a1f5b20
+Create Date: 2026-10-19 13:40:27.561902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d2f6e8a913'
+down_revision: Union[str, None] = '7c3e9a1f5b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('fleet_health',
+    sa.Column('vehicle_id', sa.String(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('sample_count', sa.Integer(), nullable=False),
+    sa.Column('overheat_rate', sa.Float(), nullable=False),
+    sa.Column('battery_trend', sa.Float(), nullable=True),
+    sa.Column('fuel_trim_drift', sa.Float(), nullable=True),
+    sa.Column('dtc_recurrence', sa.Integer(), nullable=False),
+    sa.Column('top_dtc_code', sa.String(), nullable=True),
+    sa.Column('ai_urgency', sa.Float(), nullable=True),
+    sa.Column('window_start', sa.DateTime(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('vehicle_id')
+    )
+    op.create_index('ix_fleet_health_score', 'fleet_health', ['score'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fleet_health_score', table_name='fleet_health')
+    op.drop_table('fleet_health')
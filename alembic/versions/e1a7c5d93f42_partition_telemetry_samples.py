@@ -0,0 +1,87 @@
+"""partition telemetry_samples by timestamp
+
+Revision ID: e1a7c5d93f42
+Revises: b4d2f6e8a913
+Create Date: 2026-10-19 16:05:12.734410
+
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7c5d93f42'
+down_revision: Union[str, None] = 'b4d2f6e8a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partisi harian yang langsung dibuat di depan; selanjutnya dikelola job retensi
+PRECREATE_DAYS = 7
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        print("telemetry_samples partitioning skipped: requires PostgreSQL.")
+        return
+
+    # Tabel lama tidak disalin: dipasang sebagai partisi "legacy" [MINVALUE, bound)
+    op.execute("ALTER TABLE telemetry_samples RENAME TO telemetry_samples_legacy")
+    # Partisi harus punya primary key yang sama dengan induknya (id, timestamp)
+    op.execute("ALTER TABLE telemetry_samples_legacy DROP CONSTRAINT telemetry_samples_pkey")
+    op.execute("ALTER TABLE telemetry_samples_legacy ADD CONSTRAINT telemetry_samples_legacy_pkey PRIMARY KEY (id, timestamp)")
+    op.execute("ALTER INDEX ix_telemetry_samples_vehicle_id_timestamp RENAME TO ix_telemetry_samples_legacy_vehicle_id_timestamp")
+
+    op.execute(
+        "CREATE TABLE telemetry_samples (LIKE telemetry_samples_legacy INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (timestamp)"
+    )
+    op.execute("ALTER TABLE telemetry_samples ADD CONSTRAINT telemetry_samples_pkey PRIMARY KEY (id, timestamp)")
+    op.create_index('ix_telemetry_samples_vehicle_id_timestamp', 'telemetry_samples', ['vehicle_id', 'timestamp'], unique=False)
+    op.execute("ALTER SEQUENCE telemetry_samples_id_seq OWNED BY telemetry_samples.id")
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    newest = bind.execute(sa.text("SELECT max(timestamp) FROM telemetry_samples_legacy")).scalar()
+    bound = today
+    if newest is not None and newest >= today:
+        bound = today + timedelta(days=1)
+    # Sampel bertimestamp masa depan (jam device salah) tidak memperlebar partisi legacy:
+    # dipindahkan dulu, lalu dimasukkan ulang lewat induk setelah partisinya ada
+    op.execute("CREATE TEMPORARY TABLE telemetry_samples_future (LIKE telemetry_samples_legacy)")
+    op.execute(
+        f"WITH moved AS (DELETE FROM telemetry_samples_legacy WHERE timestamp >= '{bound:%Y-%m-%d %H:%M:%S}' RETURNING *) "
+        f"INSERT INTO telemetry_samples_future SELECT * FROM moved"
+    )
+    op.execute(
+        f"ALTER TABLE telemetry_samples ATTACH PARTITION telemetry_samples_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{bound:%Y-%m-%d %H:%M:%S}')"
+    )
+    op.execute("CREATE TABLE telemetry_samples_default PARTITION OF telemetry_samples DEFAULT")
+    for i in range(PRECREATE_DAYS):
+        start = bound + timedelta(days=i)
+        end = start + timedelta(days=1)
+        op.execute(
+            f"CREATE TABLE telemetry_samples_p{start:%Y%m%d} PARTITION OF telemetry_samples "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}')"
+        )
+    # Di luar partisi harian masuk partisi default; job retensi memindahkannya nanti
+    op.execute("INSERT INTO telemetry_samples SELECT * FROM telemetry_samples_future")
+    op.execute("DROP TABLE telemetry_samples_future")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    op.execute("CREATE TABLE telemetry_samples_plain (LIKE telemetry_samples INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO telemetry_samples_plain SELECT * FROM telemetry_samples")
+    op.execute("ALTER SEQUENCE telemetry_samples_id_seq OWNED BY telemetry_samples_plain.id")
+    # Menghapus tabel induk ikut menghapus semua partisinya
+    op.execute("DROP TABLE telemetry_samples")
+    op.execute("ALTER TABLE telemetry_samples_plain RENAME TO telemetry_samples")
+    op.execute("ALTER TABLE telemetry_samples ADD CONSTRAINT telemetry_samples_pkey PRIMARY KEY (id)")
+    op.create_index('ix_telemetry_samples_vehicle_id_timestamp', 'telemetry_samples', ['vehicle_id', 'timestamp'], unique=False)
@@ -0,0 +1,293 @@
+"""Micro-benchmark fungsi hot-path dengan gerbang regresi terhadap baseline JSON.
+
+Berjalan offline: klien AI diganti stub (tidak ada panggilan jaringan) dan
+KB memakai file sementara. Setiap benchmark diukur dengan ``timeit``
+(waktu terbaik per panggilan dari beberapa ulangan) lalu dibandingkan dengan
+``benchmarks/baselines/hot_paths.json``. Baseline dan setiap run juga
+mengukur loop referensi Python murni; waktu baseline diskalakan dengan rasio
+referensi run ini terhadap referensi baseline, sehingga perbedaan kecepatan
+mesin (CI, frekuensi CPU) tidak terbaca sebagai regresi. Keluar dengan kode 1
+jika ada yang lebih lambat dari baseline terskala melebihi ambang.
+
+    python -m benchmarks.bench_hot_paths                    # bandingkan dengan baseline
+    python -m benchmarks.bench_hot_paths --update-baseline  # simpan hasil sebagai baseline baru
+    python -m benchmarks.bench_hot_paths --threshold 0.5 --only kb_lookup
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Pastikan klien AI tidak dibuat (tanpa API key tidak ada koneksi keluar)
+os.environ["KOLOSAL_API_KEY"] = ""
+
+from fastapi.encoders import jsonable_encoder
+
+from models import TelemetryIn
+from services import ai_service
+from services.api_client import _extract_json_from_text
+from services.pipeline import compute_status
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "hot_paths.json")
+# Benchmark gagal jika lebih lambat dari baseline * (1 + ambang)
+BENCH_THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "0.5"))
+
+SAMPLE = {
+    "vehicle_id": "BENCH-0001",
+    "timestamp": "2025-12-01T08:30:00+07:00",
+    "rpm": 850,
+    "speed": 0,
+    "temp": 104,
+    "tps_percent": 7.5,
+    "batt_volt": 11.2,
+    "fuel_trim_short": 17.5,
+    "o2_volt": 0.12,
+    "map_kpa": 38,
+    "dtc_code": "P0301",
+    "vehicle_model": "Toyota Avanza",
+}
+
+AI_ADVICE = {
+    "summary": "Misfire silinder 1, periksa busi dan koil pengapian.",
+    "estimated_cost_idr": 1600000,
+    "estimated_cost_text": "Rp 1.200.000 - Rp 2.000.000",
+    "urgency": "Tinggi",
+    "sources": ["kb:P0301"],
+}
+
+LLM_OUTPUT_FENCED = (
+    "Berikut hasil analisis berdasarkan data sensor:\n\n```json\n"
+    + json.dumps({
+        "summary": "Misfire pada silinder 1 kemungkinan karena busi aus atau koil lemah. "
+                   "Tegangan aki rendah dan fuel trim positif menunjukkan campuran kurus.",
+        "estimated_cost_text": "Rp 1.200.000 - Rp 2.000.000",
+        "urgency": "Tinggi",
+    }, ensure_ascii=False, indent=2)
+    + "\n```\n\nSegera bawa ke bengkel untuk pemeriksaan lebih lanjut."
+)
+LLM_OUTPUT_PLAIN = json.dumps({"summary": "Aki lemah.", "estimated_cost_text": "850rb", "urgency": "Sedang"})
+
+
+class _StubAI:
+    """Pengganti call_kolosal: jawaban tetap, mencatat jumlah panggilan."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return {
+            "summary": AI_ADVICE["summary"],
+            "estimated_cost_idr": None,
+            "estimated_cost_text": AI_ADVICE["estimated_cost_text"],
+            "urgency": "Tinggi",
+            "sources": ["stub"],
+        }
+
+
+def _write_kb(directory: str, size: int) -> str:
+    path = os.path.join(directory, f"kb_{size}.json")
+    now = datetime.utcnow().isoformat() + "Z"
+    entries = [
+        {
+            "code": f"P{i:05d}",
+            "summary": f"Entri KB sintetis {i}",
+            "estimated_cost_idr": 500000 + i,
+            "estimated_cost_text": "Rp 500.000",
+            "urgency": "Sedang",
+            "sources": ["bench"],
+            "created_at": now,
+        }
+        for i in range(size - 1)
+    ]
+    entries.append({**AI_ADVICE, "code": "P0301", "created_at": now})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    return path
+
+
+def _reference_loop() -> int:
+    """Beban Python murni tetap (dict, string, aritmetika) sebagai patokan kecepatan mesin."""
+    counts: Dict[str, int] = {}
+    for i in range(200):
+        key = f"P{i % 50:04d}"
+        counts[key] = counts.get(key, 0) + i * 3 // 2
+    return sum(counts.values())
+
+
+def _kb_lookup_bench(path: str) -> Callable[[], None]:
+    def run():
+        ai_service.KB_PATH = path
+        # Kode dicari berada di akhir KB (kasus terburuk scan linear)
+        assert ai_service._kb_lookup("P0301") is not None
+    return run
+
+
+def build_benchmarks(workdir: str, stub: _StubAI) -> List[Tuple[str, Callable[[], None]]]:
+    payload = TelemetryIn(**SAMPLE)
+    record = payload.dict(exclude_none=True)
+    record["status"] = compute_status(
+        payload.rpm, payload.temp, payload.dtc_code, payload.tps_percent, payload.batt_volt, payload.fuel_trim_short
+    )
+    record["ai_advice"] = AI_ADVICE
+
+    kb_paths = {size: _write_kb(workdir, size) for size in (10, 1000, 100000)}
+
+    def analyze_cache_hit():
+        ai_service.KB_PATH = kb_paths[1000]
+        result = ai_service.analyze_damage(
+            "P0301", 104, "Toyota Avanza", tps_percent=7.5, batt_volt=11.2, o2_volt=0.12, map_kpa=38
+        )
+        assert result["sources"] == ["kb:P0301"]
+
+    return [
+        ("compute_status", lambda: compute_status(850, 104, "P0301", 7.5, 11.2, 17.5)),
+        ("compute_status_normal", lambda: compute_status(2500, 88, None, 12.0, 12.6, 2.0)),
+        ("telemetry_in_validate", lambda: TelemetryIn(**SAMPLE)),
+        ("jsonable_encoder_record", lambda: jsonable_encoder(record)),
+        ("kb_lookup_10", _kb_lookup_bench(kb_paths[10])),
+        ("kb_lookup_1k", _kb_lookup_bench(kb_paths[1000])),
+        ("kb_lookup_100k", _kb_lookup_bench(kb_paths[100000])),
+        ("parse_idr_range_range", lambda: ai_service._parse_idr_range("Rp 1.200.000 - Rp 2.000.000")),
+        ("parse_idr_range_short", lambda: ai_service._parse_idr_range("1.2jt")),
+        ("extract_json_plain", lambda: _extract_json_from_text(LLM_OUTPUT_PLAIN)),
+        ("extract_json_fenced", lambda: _extract_json_from_text(LLM_OUTPUT_FENCED)),
+        ("analyze_damage_cache_hit", analyze_cache_hit),
+    ]
+
+
+def measure(fn: Callable[[], None], repeat: int) -> float:
+    """Waktu terbaik per panggilan (detik). Print debug dari kode yang diukur dibuang."""
+    timer = timeit.Timer(fn)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat, number)) / number
+
+
+def measure_reference(repeat: int, runs: int = 3) -> float:
+    """Median beberapa pengukuran loop referensi."""
+    return statistics.median(measure(_reference_loop, repeat) for _ in range(runs))
+
+
+def load_baseline(path: str) -> Tuple[Dict[str, float], Optional[float]]:
+    """Hasil baseline dan waktu loop referensinya (None untuk baseline lama tanpa referensi)."""
+    if not os.path.exists(path):
+        return {}, None
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("results", {}), data.get("reference")
+
+
+def save_baseline(path: str, results: Dict[str, float], reference: float) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": datetime.utcnow().isoformat() + "Z",
+        },
+        "reference": round(reference, 9),
+        "results": {name: round(seconds, 9) for name, seconds in results.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.3f} us"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD,
+                        help="Toleransi perlambatan relatif (0.5 = 50%%)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--confirm", type=int, default=2, help="Pengukuran ulang untuk benchmark yang tampak regresi")
+    parser.add_argument("--only", nargs="+", help="Jalankan benchmark yang namanya mengandung salah satu kata ini")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", help="Tulis hasil mentah ke file ini")
+    args = parser.parse_args()
+
+    stub = _StubAI()
+    ai_service.call_kolosal = stub
+    original_kb_path = ai_service.KB_PATH
+
+    baseline, base_reference = load_baseline(args.baseline)
+    reference = measure_reference(args.repeat)
+    # Faktor kecepatan mesin ini terhadap mesin/run baseline (>1 = lebih lambat)
+    scale = reference / base_reference if base_reference else 1.0
+    print(f"Referensi: {_fmt(reference)} (baseline {_fmt(base_reference) if base_reference else '-'}, faktor {scale:.2f})")
+    results: Dict[str, float] = {}
+    regressions = []
+    with tempfile.TemporaryDirectory(prefix="otosense_bench_") as workdir:
+        try:
+            benchmarks = build_benchmarks(workdir, stub)
+            if args.only:
+                benchmarks = [(n, fn) for n, fn in benchmarks if any(k in n for k in args.only)]
+
+            print(f"{'benchmark':<28} {'waktu':>12} {'baseline*':>12} {'rasio':>7}")
+            for name, fn in benchmarks:
+                if args.update_baseline:
+                    # Baseline = median beberapa pengukuran, agar satu run yang kebetulan cepat tidak jadi patokan
+                    seconds = statistics.median(measure(fn, args.repeat) for _ in range(args.confirm + 1))
+                else:
+                    seconds = measure(fn, args.repeat)
+                base = baseline.get(name)
+                if base:
+                    base *= scale
+                # Mesin bersama bisa berisik: ukur ulang (beserta referensinya) sebelum menyatakan regresi
+                for _ in range(args.confirm if base and not args.update_baseline else 0):
+                    if seconds <= base * (1 + args.threshold):
+                        break
+                    seconds = min(seconds, measure(fn, args.repeat))
+                    if base_reference:
+                        base = baseline[name] * measure_reference(args.repeat, runs=1) / base_reference
+                results[name] = seconds
+                ratio = seconds / base if base else None
+                flag = ""
+                if ratio is not None and ratio > 1 + args.threshold:
+                    regressions.append(name)
+                    flag = "  REGRESI"
+                print(
+                    f"{name:<28} {_fmt(seconds):>12} {_fmt(base) if base else '-':>12} "
+                    f"{f'{ratio:.2f}x' if ratio else '-':>7}{flag}"
+                )
+        finally:
+            ai_service.KB_PATH = original_kb_path
+
+    if stub.calls:
+        print(f"Peringatan: stub AI dipanggil {stub.calls}x (jalur cache-hit seharusnya tidak memanggil AI)")
+        regressions.append("analyze_damage_cache_hit")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        # Entri yang tidak diukur ulang (--only) ikut diskalakan ke referensi baru
+        merged = {**{name: seconds * scale for name, seconds in baseline.items()}, **results}
+        save_baseline(args.baseline, merged, reference)
+        print(f"Baseline diperbarui: {args.baseline}")
+        return 0
+    if not baseline:
+        print("Belum ada baseline; jalankan dengan --update-baseline.")
+        return 0
+    if regressions:
+        print(f"Gagal: {len(regressions)} benchmark lebih lambat dari ambang {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("OK: tidak ada regresi.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Benchmark throughput ingest: pipeline biasa vs mode urut per kendaraan, per jumlah worker.
+
+Pipeline dijalankan dengan stage enrich dan persist disimulasikan: sampel
+yang butuh AI (status CRITICAL / ada DTC) menunggu latensi AI, setiap sampel
+menunggu latensi database. Sejumlah sampel dari banyak kendaraan dikirim
+bersamaan seperti request HTTP paralel. Selain throughput, dilaporkan
+latensi maksimum sampel yang tidak butuh AI dan jumlah sampel yang tersimpan
+tidak sesuai urutan per kendaraan. ``--workers`` menjalankan N proses
+terpisah (seperti worker uvicorn) yang masing-masing menerima kendaraan
+berbeda, untuk melihat skala antar core.
+
+    python -m benchmarks.bench_ordering --samples 5000 --vehicles 200 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from services.ordering import OrderedPipeline
+from services.pipeline import PipelineContext, TelemetryPipeline, needs_ai
+
+
+class SimulatedAI:
+    """Stage enrich palsu: sampel yang butuh AI menunggu ``latency`` detik."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def __call__(self, ctx: PipelineContext) -> None:
+        if needs_ai(ctx):
+            await asyncio.sleep(self.latency)
+            ctx.ai_advice = {"summary": "simulasi", "urgency": "Tinggi"}
+        ctx.record["ai_advice"] = ctx.ai_advice
+
+
+class SimulatedDatabase:
+    """Stage persist palsu: menunggu ``latency`` detik dan mencatat urutan per kendaraan."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.last_seen: dict[str, datetime] = {}
+        self.out_of_order = 0
+
+    async def __call__(self, ctx: PipelineContext) -> None:
+        await asyncio.sleep(self.latency)
+        vid = ctx.payload.vehicle_id
+        last = self.last_seen.get(vid)
+        if last is not None and ctx.payload.timestamp < last:
+            self.out_of_order += 1
+        self.last_seen[vid] = ctx.payload.timestamp
+
+
+def build_samples(count: int, vehicles: int) -> list[dict]:
+    base = datetime(2025, 12, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "vehicle_id": f"BENCH-{i % vehicles:04d}",
+            "timestamp": (base + timedelta(milliseconds=i)).isoformat(),
+            "rpm": 1500 + (i * 37) % 5500,
+            "speed": (i * 7) % 120,
+            "temp": 80 + (i * 13) % 30,
+            "batt_volt": 11.0 + (i % 30) / 10,
+            "fuel_trim_short": ((i * 11) % 40) - 20.0,
+            "tps_percent": (i % 20) * 1.0,
+            "vehicle_model": "Toyota Avanza",
+        }
+        for i in range(count)
+    ]
+
+
+async def run_once(samples: list[dict], ordered: bool, latency: float, ai_latency: float) -> dict:
+    db = SimulatedDatabase(latency)
+    pipeline = TelemetryPipeline(enrich=SimulatedAI(ai_latency), persist=db)
+    runner = OrderedPipeline(pipeline) if ordered else pipeline
+    no_ai_latency = []
+
+    async def send(sample: dict) -> None:
+        sent = time.perf_counter()
+        ctx = await runner.run(sample)
+        if not needs_ai(ctx):
+            no_ai_latency.append(time.perf_counter() - sent)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(s) for s in samples))
+    return {
+        "seconds": time.perf_counter() - start,
+        "max_no_ai": max(no_ai_latency, default=0),
+        "out_of_order": db.out_of_order,
+    }
+
+
+def _worker(samples: list[dict], ordered: bool, latency: float, ai_latency: float) -> dict:
+    return asyncio.run(run_once(samples, ordered, latency, ai_latency))
+
+
+def run_workers(samples: list[dict], workers: int, ordered: bool, latency: float, ai_latency: float) -> dict:
+    """Bagi kendaraan ke ``workers`` proses (seperti load balancer yang sticky per kendaraan)."""
+    parts = [[s for s in samples if zlib.crc32(s["vehicle_id"].encode()) % workers == i] for i in range(workers)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(_worker, parts, [ordered] * workers, [latency] * workers, [ai_latency] * workers))
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 3),
+        "samples_per_sec": round(len(samples) / elapsed, 1),
+        "max_no_ai_ms": round(max(r["max_no_ai"] for r in results) * 1000, 1),
+        "out_of_order": sum(r["out_of_order"] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--ai-latency-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    samples = build_samples(args.samples, args.vehicles)
+    print(f"{'mode':>8} {'worker':>6} {'detik':>8} {'sampel/dtk':>12} {'maks non-AI ms':>15} {'out_of_order':>12}")
+    for workers in args.workers:
+        for mode in ("biasa", "urut"):
+            result = run_workers(samples, workers, mode == "urut", args.db_latency_ms / 1000, args.ai_latency_ms / 1000)
+            print(
+                f"{mode:>8} {workers:>6} {result['seconds']:>8} {result['samples_per_sec']:>12} "
+                f"{result['max_no_ai_ms']:>15} {result['out_of_order']:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
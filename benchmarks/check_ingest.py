@@ -0,0 +1,451 @@
+"""Pemeriksaan regresi jalur ingest dan job latar yang berjalan offline (tanpa HTTP, server database, atau AI).
+
+Setiap pemeriksaan menyusun pipeline dengan stage pengganti in-memory (atau
+SQLite sementara untuk job yang membaca telemetry_samples) dan mensimulasikan
+kegagalan yang pernah menyebabkan data hilang atau job macet. Keluar dengan
+kode 1 jika ada pemeriksaan yang gagal.
+
+    python -m benchmarks.check_ingest
+    python -m benchmarks.check_ingest --only dedup
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Tuple
+
+# Modul database dibutuhkan untuk definisi tabel saja; tidak ada koneksi yang dibuka
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from databases import Database
+from sqlalchemy import create_engine
+
+from database import FleetHealth, TelemetryRollup
+from services import rollups as rollups_module
+from services.dedup import ReplayDeduplicator
+from services.fleet_health import compute_fleet_health
+from services.pipeline import TelemetryPipeline
+from services.realtime import Hub, Subscriber, parse_resume_from
+from services.shared_state import SharedStateTable
+from services.rollups import RollupAccumulator, backfill_rollups, flush_rollups
+from services.write_behind import WriteBehindFull, WriteBehindSink
+
+SAMPLE = {
+    "vehicle_id": "CHECK-0001",
+    "timestamp": "2025-12-01T08:30:00+07:00",
+    "rpm": 2500,
+    "speed": 40,
+    "temp": 88,
+    "batt_volt": 12.6,
+}
+
+
+class _FlakySink:
+    """Stage persist yang gagal ``failures`` kali pertama, lalu menyimpan ke list."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.rows = []
+
+    def __call__(self, ctx) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database down")
+        self.rows.append(ctx.record)
+
+
+async def check_dedup_retry_after_persist_failure() -> None:
+    """Retry device setelah persist gagal tidak boleh dibuang sebagai duplikat."""
+    sink = _FlakySink(failures=1)
+    pipeline = TelemetryPipeline(dedup=ReplayDeduplicator(), enrich=None, persist=sink)
+    try:
+        await pipeline.run(dict(SAMPLE))
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("persist pertama seharusnya gagal")
+    ctx = await pipeline.run(dict(SAMPLE))
+    assert ctx.dropped is None, f"retry dibuang: {ctx.dropped}"
+    assert len(sink.rows) == 1, f"{len(sink.rows)} baris tersimpan, seharusnya 1"
+    # Setelah berhasil, paket yang sama memang duplikat
+    ctx = await pipeline.run(dict(SAMPLE))
+    assert ctx.dropped == "duplicate"
+
+
+class _FakeDatabase:
+    """Pengganti ``databases.Database`` untuk write-behind; ``down=True`` membuat setiap transaksi gagal."""
+
+    def __init__(self):
+        self.down = False
+        self.statements = 0
+
+    def transaction(self):
+        return self
+
+    def connection(self):
+        return _FakeConnection()
+
+    async def __aenter__(self):
+        if self.down:
+            raise ConnectionError("database down")
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        if self.down:
+            raise ConnectionError("database down")
+        self.statements += 1
+
+
+class _FakeConnection:
+    raw_connection = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _samples(n: int) -> List[dict]:
+    return [dict(SAMPLE, timestamp=f"2025-12-01T08:{i // 60:02d}:{i % 60:02d}+07:00") for i in range(n)]
+
+
+def _minute_samples(rollups: RollupAccumulator) -> int:
+    return sum(row["sample_count"] for row in rollups.drain() if row["bucket"] == "minute")
+
+
+async def check_write_behind_caps_pending_rows() -> None:
+    """Saat database down, buffer write-behind tidak boleh melebihi max_pending (sisanya 503)."""
+    db = _FakeDatabase()
+    db.down = True
+    with tempfile.TemporaryDirectory() as workdir:
+        sink = WriteBehindSink(db, log_path=os.path.join(workdir, "wb.log"), max_pending=5)
+        sink.sink.rollups = RollupAccumulator()
+        pipeline = TelemetryPipeline(enrich=None, persist=sink)
+        rejected = 0
+        for payload in _samples(20):
+            try:
+                await pipeline.run(payload)
+            except WriteBehindFull:
+                rejected += 1
+        assert len(sink._buffer) == 5, f"{len(sink._buffer)} baris tertahan, batas 5"
+        assert rejected == 15, f"{rejected} sampel ditolak, seharusnya 15"
+
+        db.down = False
+        assert await sink.flush() == 5
+        assert _minute_samples(sink.sink.rollups) == 5
+
+
+async def check_write_behind_recover_feeds_rollups() -> None:
+    """Baris yang di-replay dari log setelah crash harus ikut masuk rollup."""
+    db = _FakeDatabase()
+    db.down = True
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "wb.log")
+        crashed = WriteBehindSink(db, log_path=log_path)
+        crashed.sink.rollups = RollupAccumulator()
+        pipeline = TelemetryPipeline(enrich=None, persist=crashed)
+        for payload in _samples(3):
+            await pipeline.run(payload)
+        # Proses mati: log tidak di-flush, lock slot dilepas oleh kernel
+        crashed._log.close()
+        crashed.release()
+
+        db.down = False
+        restarted = WriteBehindSink(db, log_path=log_path)
+        restarted.sink.rollups = RollupAccumulator()
+        assert await restarted.recover() == 3
+        assert _minute_samples(restarted.sink.rollups) == 3
+        leftover = [name for name in os.listdir(workdir) if not name.endswith(".lock")]
+        assert not leftover, f"segmen log tidak dihapus setelah recovery: {leftover}"
+        restarted.release()
+
+
+async def check_write_behind_recover_skips_live_workers() -> None:
+    """Worker yang start tidak boleh me-replay atau menghapus log worker lain yang masih hidup."""
+    db = _FakeDatabase()
+    db.down = True
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "wb.log")
+        live = WriteBehindSink(db, log_path=log_path)
+        dead = WriteBehindSink(db, log_path=log_path)
+        for sink, samples in ((live, _samples(2)), (dead, _samples(3))):
+            sink.sink.rollups = RollupAccumulator()
+            pipeline = TelemetryPipeline(enrich=None, persist=sink)
+            for payload in samples:
+                await pipeline.run(payload)
+        assert (live.slot, dead.slot) == (0, 1)
+        # Satu segmen rotasi (flush gagal) dan satu log aktif untuk worker yang mati
+        try:
+            await dead.flush()
+        except ConnectionError:
+            pass
+        await TelemetryPipeline(enrich=None, persist=dead).run(_samples(4)[3])
+        dead._log.close()
+        dead.release()
+
+        db.down = False
+        started = WriteBehindSink(db, log_path=log_path)
+        started.sink.rollups = RollupAccumulator()
+        assert await started.recover() == 4, "hanya baris worker yang mati yang boleh di-replay"
+        assert started.slot == 1
+        assert os.path.exists(live.log_path), "log aktif worker yang hidup dipindahkan"
+        assert await live.flush() == 2
+        leftover = [name for name in os.listdir(workdir) if not name.endswith(".lock")]
+        assert not leftover, f"log tersisa: {leftover}"
+        live.release()
+        started.release()
+
+
+async def check_rollup_flush_failure_keeps_aggregates() -> None:
+    """Agregat rollup tidak boleh hilang jika upsert gagal; digabung dengan sampel baru di flush berikutnya."""
+    db = _FakeDatabase()
+    rollups = RollupAccumulator()
+    ts = datetime(2025, 12, 1, 8, 30, 5)
+    rollups.add("CHECK-0001", ts, 2000, 90, 12.4, ["NORMAL"])
+    rollups.add("CHECK-0001", ts.replace(second=40), 3000, 105, None, ["OVERHEAT", "CRITICAL"])
+    db.down = True
+    try:
+        await flush_rollups(db, rollups)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("flush pertama seharusnya gagal")
+    assert len(rollups) == 2, f"{len(rollups)} akumulator tersisa, seharusnya 2 (menit + jam)"
+
+    rollups.add("CHECK-0001", ts.replace(second=50), 1000, 80, 11.0, ["LOW_BATTERY"])
+    rows = {row["bucket"]: row for row in rollups.drain()}
+    minute = rows["minute"]
+    assert minute["sample_count"] == 3 and minute["batt_volt_count"] == 2
+    assert (minute["temp_min"], minute["temp_max"], minute["temp_sum"]) == (80, 105, 275)
+    assert (minute["batt_volt_min"], minute["batt_volt_max"]) == (11.0, 12.4)
+    assert minute["count_overheat"] == 1 and minute["count_low_battery"] == 1 and minute["count_normal"] == 1
+
+
+# Tabel sampel versi SQLite (model aslinya memakai primary key komposit khusus PostgreSQL)
+_SAMPLES_DDL = (
+    "CREATE TABLE telemetry_samples (id INTEGER PRIMARY KEY, vehicle_id TEXT NOT NULL, "
+    "timestamp DATETIME NOT NULL, rpm INTEGER NOT NULL, speed INTEGER, temp INTEGER NOT NULL, dtc_code TEXT, "
+    "tps_percent REAL, batt_volt REAL, fuel_trim_short REAL, o2_volt REAL, map_kpa REAL, "
+    "vehicle_model TEXT, status JSON NOT NULL, ai_advice JSON)"
+)
+
+
+class _SingleConnection:
+    """Database SQLite yang menolak query selama cursor ``iterate`` masih terbuka.
+
+    Meniru satu koneksi asyncpg ("another operation is in progress"): tanpa
+    replica, ``read_database`` adalah database utama dan koneksi per task-nya
+    tidak reentrant, sehingga menulis di tengah ``iterate`` macet di produksi.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.url = database.url
+        self._cursor_open = False
+
+    def _check(self) -> None:
+        if self._cursor_open:
+            raise AssertionError("query dijalankan saat cursor iterate masih terbuka di koneksi yang sama")
+
+    async def iterate(self, query):
+        self._check()
+        self._cursor_open = True
+        try:
+            async for row in self.database.iterate(query):
+                yield row
+        finally:
+            self._cursor_open = False
+
+    async def fetch_all(self, query, values=None):
+        self._check()
+        return await self.database.fetch_all(query, values)
+
+    async def fetch_val(self, query, values=None):
+        self._check()
+        return await self.database.fetch_val(query, values)
+
+    async def execute(self, query, values=None):
+        self._check()
+        return await self.database.execute(query, values)
+
+    def transaction(self):
+        return self.database.transaction()
+
+
+def _ignore_nulls(pick):
+    def fn(*values):
+        values = [v for v in values if v is not None]
+        return pick(values) if values else None
+    return fn
+
+
+@asynccontextmanager
+async def _sqlite_samples(rows: List[dict]):
+    """SQLite sementara berisi telemetry_samples ``rows`` dan tabel turunan, dibungkus ``_SingleConnection``."""
+    with tempfile.TemporaryDirectory() as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'check.db')}"
+        engine = create_engine(url)
+        FleetHealth.__table__.create(engine)
+        TelemetryRollup.__table__.create(engine)
+        engine.dispose()
+        database = Database(url.replace("sqlite:", "sqlite+aiosqlite:"))
+        await database.connect()
+        try:
+            # Upsert rollup memakai least/greatest PostgreSQL (mengabaikan NULL)
+            async with database.connection() as connection:
+                for name, pick in (("least", min), ("greatest", max)):
+                    await connection.raw_connection.create_function(name, 2, _ignore_nulls(pick))
+                await database.execute(_SAMPLES_DDL)
+                await database.execute_many(
+                    "INSERT INTO telemetry_samples (vehicle_id, timestamp, rpm, temp, batt_volt, status) "
+                    "VALUES (:vehicle_id, :timestamp, :rpm, :temp, :batt_volt, :status)",
+                    rows,
+                )
+                yield _SingleConnection(database)
+        finally:
+            await database.disconnect()
+
+
+def _history(n: int, vehicles: int, start: datetime) -> List[dict]:
+    return [
+        {"vehicle_id": f"CHECK-{i % vehicles:04d}", "timestamp": start + timedelta(minutes=i),
+         "rpm": 2000 + i, "temp": 85 + i % 25, "batt_volt": 12.6 - (i % 10) / 10, "status": '["NORMAL"]'}
+        for i in range(n)
+    ]
+
+
+async def check_fleet_health_without_replica() -> None:
+    """Tanpa read replica (read_database is database) job fleet health tidak boleh menulis di tengah cursor."""
+    rows = _history(300, vehicles=7, start=datetime.utcnow() - timedelta(days=1))
+    async with _sqlite_samples(rows) as db:
+        scored = await compute_fleet_health(db, batch_rows=50, read_database=db)
+        assert scored == 7, f"{scored} kendaraan dinilai, seharusnya 7"
+        total = await db.fetch_val("SELECT sum(sample_count) FROM fleet_health")
+        assert total == 300, f"{total} sampel dinilai, seharusnya 300"
+
+
+async def check_rollup_backfill_larger_than_batch() -> None:
+    """Backfill dengan lebih dari ROLLUP_BATCH_SIZE akumulator tidak boleh upsert di tengah cursor."""
+    rows = _history(1500, vehicles=3, start=datetime(2025, 12, 1, 8, 0))
+    page_rows = rollups_module.BACKFILL_PAGE_ROWS
+    rollups_module.BACKFILL_PAGE_ROWS = 400
+    try:
+        async with _sqlite_samples(rows) as db:
+            total = await backfill_rollups(db)
+            assert total == 1500, f"{total} sampel diproses, seharusnya 1500"
+            counts = await db.fetch_all(
+                "SELECT bucket, count(*) AS n, sum(sample_count) AS samples FROM telemetry_rollups GROUP BY bucket"
+            )
+            counts = {r["bucket"]: (r["n"], r["samples"]) for r in counts}
+            assert counts == {"minute": (1500, 1500), "hour": (75, 1500)}, counts
+    finally:
+        rollups_module.BACKFILL_PAGE_ROWS = page_rows
+
+
+async def check_shared_state_ignores_stale_packets() -> None:
+    """Paket lama yang diproses worker lain tidak boleh menimpa state terbaru di tabel shared-memory."""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "state")
+        worker_a = SharedStateTable(path, slots=16, record_size=512)
+        worker_b = SharedStateTable(path, slots=16, record_size=512)
+        try:
+            newer = dict(SAMPLE, timestamp="2025-12-01T08:00:10+07:00")
+            assert worker_a.put(SAMPLE["vehicle_id"], newer)
+            assert not worker_b.put(SAMPLE["vehicle_id"], dict(SAMPLE, timestamp="2025-12-01T08:00:05+07:00"))
+            # Record lama yang terlalu besar juga tidak boleh mengosongkan slot
+            assert not worker_b.put(SAMPLE["vehicle_id"], dict(SAMPLE, timestamp="2025-12-01T08:00:06+07:00", pad="x" * 1024))
+            served = worker_b.get(SAMPLE["vehicle_id"])
+            assert served == newer, f"slot menyajikan {served}"
+            assert worker_b.put(SAMPLE["vehicle_id"], dict(SAMPLE, timestamp="2025-12-01T08:00:10+07:00", rpm=1))
+            assert worker_a.get(SAMPLE["vehicle_id"])["rpm"] == 1
+        finally:
+            worker_a.close()
+            worker_b.close()
+
+
+class _FakeWebSocket:
+    """Mengumpulkan pesan yang dikirim hub sebagai dict."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_text(self, text: str) -> None:
+        self.messages.append(json.loads(text))
+
+    async def send_json(self, data) -> None:
+        self.messages.append(data)
+
+
+async def check_realtime_resume_checks_epoch() -> None:
+    """Resume dari epoch lain (restart / worker lain) harus mendapat snapshot, bukan replay seq lokal."""
+    hub = Hub(buffer_size=100)
+    state = {"CHECK-0001": {"vehicle_id": "CHECK-0001", "rpm": 3}}
+    for rpm in (1, 2, 3):
+        await hub.publish("CHECK-0001", {"vehicle_id": "CHECK-0001", "rpm": rpm})
+
+    plain = _FakeWebSocket()
+    await hub.attach(Subscriber(plain), lambda _: state, snapshot=False)
+    await hub.publish("CHECK-0001", {"vehicle_id": "CHECK-0001", "rpm": 4})
+    assert plain.messages == [{"vehicle_id": "CHECK-0001", "rpm": 4, "seq": 4, "epoch": hub.epoch}], plain.messages
+
+    same = _FakeWebSocket()
+    await hub.attach(Subscriber(same, feed=True), lambda _: state, resume_from=parse_resume_from(f"{hub.epoch}:2"))
+    assert [(m["type"], m["seq"]) for m in same.messages] == [("event", 3), ("event", 4)], same.messages
+
+    for token in ("0", "1", "otherepoch:2"):
+        foreign = _FakeWebSocket()
+        await hub.attach(Subscriber(foreign, feed=True), lambda _: state, resume_from=parse_resume_from(token))
+        assert [m["type"] for m in foreign.messages] == ["snapshot"], f"{token}: {foreign.messages}"
+        assert foreign.messages[0]["epoch"] == hub.epoch
+
+
+CHECKS: List[Tuple[str, Callable[[], Awaitable[None]]]] = [
+    ("dedup_retry_after_persist_failure", check_dedup_retry_after_persist_failure),
+    ("write_behind_caps_pending_rows", check_write_behind_caps_pending_rows),
+    ("write_behind_recover_feeds_rollups", check_write_behind_recover_feeds_rollups),
+    ("write_behind_recover_skips_live_workers", check_write_behind_recover_skips_live_workers),
+    ("rollup_flush_failure_keeps_aggregates", check_rollup_flush_failure_keeps_aggregates),
+    ("realtime_resume_checks_epoch", check_realtime_resume_checks_epoch),
+    ("fleet_health_without_replica", check_fleet_health_without_replica),
+    ("rollup_backfill_larger_than_batch", check_rollup_backfill_larger_than_batch),
+    ("shared_state_ignores_stale_packets", check_shared_state_ignores_stale_packets),
+]
+
+
+async def run_checks(only: List[str]) -> int:
+    failed = 0
+    for name, check in CHECKS:
+        if only and not any(k in name for k in only):
+            continue
+        try:
+            await check()
+        except Exception as e:
+            failed += 1
+            print(f"GAGAL {name}: {e!r}")
+        else:
+            print(f"ok    {name}")
+    return failed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", help="Jalankan pemeriksaan yang namanya mengandung salah satu kata ini")
+    args = parser.parse_args()
+    failed = asyncio.run(run_checks(args.only or []))
+    if failed:
+        print(f"Gagal: {failed} pemeriksaan.")
+        return 1
+    print("OK: semua pemeriksaan lolos.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,55 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON
+from sqlalchemy import create_engine, bindparam, Column, Index, BigInteger, Integer, String, Float, DateTime, JSON
+from sqlalchemy.dialects.postgresql import asyncpg as asyncpg_dialect, insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import select
 from databases import Database
+import json
 import os
+import time
 from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Sequence
+
+from services.metrics import metrics
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Opsional: replica baca untuk /api/status, /api/vehicles/db, rollup dan ekspor
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# statement_timeout Postgres (ms) untuk semua koneksi pool; 0 = tanpa batas (default).
+# Berlaku juga untuk job pemeliharaan (backfill rollup, skor armada), jadi jangan terlalu kecil.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Jumlah prepared statement yang di-cache asyncpg per koneksi
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+
+def _pool_options(url: str) -> Dict[str, Any]:
+    if not url or not url.startswith("postgres"):
+        return {}
+    options: Dict[str, Any] = {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        options["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    return options
 
-if DATABASE_URL and "+asyncpg" in DATABASE_URL:
-    SYNC_DATABASE_URL = DATABASE_URL.replace("+asyncpg", "")
-else:
-    SYNC_DATABASE_URL = DATABASE_URL
 
-engine = create_engine(SYNC_DATABASE_URL)
+database = Database(DATABASE_URL, **_pool_options(DATABASE_URL))
+read_database = Database(READ_DATABASE_URL, **_pool_options(READ_DATABASE_URL)) if READ_DATABASE_URL else database
 
-database = Database(DATABASE_URL)
+_engine = None
+
+
+def get_engine():
+    """Engine sinkron, dibuat hanya saat dibutuhkan (create_db_and_tables)."""
+    global _engine
+    if _engine is None:
+        sync_url = DATABASE_URL.replace("+asyncpg", "") if DATABASE_URL else DATABASE_URL
+        _engine = create_engine(sync_url)
+    return _engine
 
 
 Base = declarative_base()
@@ -38,5 +74,199 @@ class TelemetryRecord(Base):
     status = Column(JSON, nullable=False) 
     ai_advice = Column(JSON, nullable=True)
 
+
+class TelemetrySample(Base):
+    """Riwayat mentah telemetry (append-only), satu baris per sampel.
+
+    Di PostgreSQL tabel ini dipartisi per rentang ``timestamp`` (harian/mingguan);
+    partisi dibuat dan dihapus oleh job retensi (services/retention.py).
+    """
+    __tablename__ = "telemetry_samples"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    vehicle_id = Column(String, nullable=False)
+    # Kunci partisi wajib menjadi bagian primary key tabel terpartisi
+    timestamp = Column(DateTime, primary_key=True, nullable=False)
+
+    rpm = Column(Integer, nullable=False)
+    speed = Column(Integer, nullable=True)
+    temp = Column(Integer, nullable=False)
+    dtc_code = Column(String, nullable=True)
+    tps_percent = Column(Float, nullable=True)
+    batt_volt = Column(Float, nullable=True)
+    fuel_trim_short = Column(Float, nullable=True)
+    o2_volt = Column(Float, nullable=True)
+    map_kpa = Column(Float, nullable=True)
+    vehicle_model = Column(String, nullable=True)
+
+    status = Column(JSON, nullable=False)
+    ai_advice = Column(JSON, nullable=True)
+
+    __table_args__ = (
+        Index("ix_telemetry_samples_vehicle_id_timestamp", "vehicle_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+
+class TelemetryRollup(Base):
+    """Agregat per kendaraan per menit/jam, di-upsert secara inkremental dari jalur ingest."""
+    __tablename__ = "telemetry_rollups"
+
+    vehicle_id = Column(String, primary_key=True)
+    bucket = Column(String, primary_key=True)  # "minute" | "hour"
+    bucket_start = Column(DateTime, primary_key=True)
+
+    sample_count = Column(Integer, nullable=False, default=0)
+    temp_min = Column(Float, nullable=True)
+    temp_max = Column(Float, nullable=True)
+    temp_sum = Column(Float, nullable=False, default=0)
+    rpm_min = Column(Float, nullable=True)
+    rpm_max = Column(Float, nullable=True)
+    rpm_sum = Column(Float, nullable=False, default=0)
+    batt_volt_min = Column(Float, nullable=True)
+    batt_volt_max = Column(Float, nullable=True)
+    batt_volt_sum = Column(Float, nullable=False, default=0)
+    batt_volt_count = Column(Integer, nullable=False, default=0)
+
+    count_normal = Column(Integer, nullable=False, default=0)
+    count_overheat = Column(Integer, nullable=False, default=0)
+    count_overspeed = Column(Integer, nullable=False, default=0)
+    count_low_battery = Column(Integer, nullable=False, default=0)
+    count_idle_tps_error = Column(Integer, nullable=False, default=0)
+    count_afr_issue = Column(Integer, nullable=False, default=0)
+    count_critical = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_telemetry_rollups_bucket_start", "bucket", "bucket_start"),
+    )
+
+
+class FleetHealth(Base):
+    """Skor kesehatan per kendaraan hasil job terjadwal (services/fleet_health.py)."""
+    __tablename__ = "fleet_health"
+
+    vehicle_id = Column(String, primary_key=True)
+    score = Column(Float, nullable=False)  # 0 (perlu servis) .. 100 (sehat)
+    sample_count = Column(Integer, nullable=False)
+    overheat_rate = Column(Float, nullable=False)
+    battery_trend = Column(Float, nullable=True)  # volt per hari
+    fuel_trim_drift = Column(Float, nullable=True)
+    dtc_recurrence = Column(Integer, nullable=False)
+    top_dtc_code = Column(String, nullable=True)
+    ai_urgency = Column(Float, nullable=True)  # 0 (Rendah) .. 1 (Tinggi)
+    window_start = Column(DateTime, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_fleet_health_score", "score"),
+    )
+
+
 def create_db_and_tables():
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(get_engine())
+
+
+def pool_stats(db: Database) -> Dict[str, int]:
+    pool = getattr(getattr(db, "_backend", None), "_pool", None)
+    if pool is None or not hasattr(pool, "get_size"):
+        return {}
+    return {"size": pool.get_size(), "idle": pool.get_idle_size(), "max": pool.get_max_size()}
+
+
+class PreparedQuery:
+    """Query hot-path yang dikompilasi sekali ke SQL asyncpg (``$n``).
+
+    Teks SQL yang stabil membuat asyncpg memakai ulang prepared statement dari
+    cache per koneksi, dan kompilasi SQLAlchemy tidak diulang setiap request.
+    Waktu tunggu pool dicatat sebagai ``db.pool_wait``. Untuk driver selain
+    asyncpg, query dijalankan lewat jalur ``databases`` biasa.
+    """
+
+    def __init__(self, name: str, query, json_columns: Sequence[str] = ()):
+        self.name = name
+        self.query = query
+        compiled = query.compile(dialect=asyncpg_dialect.dialect())
+        self.sql = compiled.string
+        self.param_names = list(compiled.positiontup or ())
+        self.defaults = dict(compiled.params)
+        self.json_columns = set(json_columns)
+
+    def _args(self, values: Dict[str, Any]) -> list:
+        args = []
+        for name in self.param_names:
+            value = values[name] if name in values else self.defaults.get(name)
+            if name in self.json_columns and value is not None:
+                value = json.dumps(value, ensure_ascii=False)
+            args.append(value)
+        return args
+
+    def _row(self, row) -> Dict[str, Any]:
+        data = dict(row)
+        for col in self.json_columns:
+            if isinstance(data.get(col), str):
+                data[col] = json.loads(data[col])
+        return data
+
+    async def _run(self, db: Database, method: str, values: Dict[str, Any]):
+        start = time.perf_counter()
+        async with db.connection() as connection:
+            metrics.observe("db.pool_wait", time.perf_counter() - start)
+            raw = connection.raw_connection
+            query_start = time.perf_counter()
+            try:
+                if hasattr(raw, "fetchrow"):
+                    return await getattr(raw, method)(self.sql, *self._args(values))
+                if method == "execute":
+                    return await connection.execute(self.query, values)
+                bound = self.query.params(**values)
+                if method == "fetchrow":
+                    return await connection.fetch_one(bound)
+                return await connection.fetch_all(bound)
+            finally:
+                metrics.observe(f"db.query.{self.name}", time.perf_counter() - query_start)
+
+    async def fetch_one(self, db: Database, **values) -> Optional[Dict[str, Any]]:
+        row = await self._run(db, "fetchrow", values)
+        return self._row(row) if row is not None else None
+
+    async def fetch_all(self, db: Database, **values) -> list[Dict[str, Any]]:
+        return [self._row(r) for r in await self._run(db, "fetch", values)]
+
+    async def execute(self, db: Database, **values) -> None:
+        await self._run(db, "execute", values)
+
+
+_LATEST_COLUMNS = (
+    "vehicle_id", "timestamp", "rpm", "temp", "dtc_code", "tps_percent", "batt_volt",
+    "fuel_trim_short", "o2_volt", "map_kpa", "vehicle_model", "status", "ai_advice",
+)
+
+
+def _upsert_latest_query():
+    stmt = insert(TelemetryRecord.__table__).values({c: bindparam(c) for c in _LATEST_COLUMNS})
+    return stmt.on_conflict_do_update(
+        index_elements=["vehicle_id"],
+        set_={c: stmt.excluded[c] for c in _LATEST_COLUMNS if c != "vehicle_id"},
+        # Paket lama (out-of-order) tidak menimpa state terakhir
+        where=TelemetryRecord.__table__.c.timestamp <= stmt.excluded.timestamp,
+    )
+
+
+STATUS_QUERY = PreparedQuery(
+    "status",
+    select(TelemetryRecord.__table__)
+    .where(TelemetryRecord.vehicle_id == bindparam("vehicle_id"))
+    .order_by(TelemetryRecord.timestamp.desc())
+    .limit(1),
+    json_columns=("status", "ai_advice"),
+)
+
+VEHICLE_IDS_QUERY = PreparedQuery("vehicle_ids", select(TelemetryRecord.vehicle_id).distinct())
+
+UPSERT_LATEST_QUERY = PreparedQuery("upsert_latest", _upsert_latest_query(), json_columns=("status", "ai_advice"))
+
+INSERT_SAMPLE_QUERY = PreparedQuery(
+    "insert_sample",
+    TelemetrySample.__table__.insert().values({c: bindparam(c) for c in _LATEST_COLUMNS + ("speed",)}),
+    json_columns=("status", "ai_advice"),
+)
\ No newline at end of file
@@ -1,20 +1,41 @@
 from typing import Any, Dict
+import asyncio
 import os
-import json
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.sql import select
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except Exception:
     pass
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
-from database import database, TelemetryRecord
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from datetime import datetime
+from database import STATUS_QUERY, VEHICLE_IDS_QUERY, database, pool_stats, read_database
 from models import TelemetryIn, TelemetryOut
-from services.ai_service import analyze_damage
+from services.metrics import metrics
+from services.admission import AdmissionController
+from services.pipeline import DatabaseSink, Publisher, TelemetryPipeline, compute_status
+from services.dedup import ReplayDeduplicator
+from services.ordering import INGEST_ORDERED, OrderedPipeline
+from services.write_behind import WRITE_BEHIND, WriteBehindFull, WriteBehindSink
+from services.export import EXPORT_FORMATS, pq, stream_export
+from services.analytics import (
+    ANALYTICS_RETENTION_HOURS,
+    ANALYTICS_SNAPSHOT_SECONDS,
+    GROUPINGS,
+    analytics,
+    load_analytics_snapshot,
+    merged_counters,
+    run_analytics_snapshots,
+)
+from services.fleet_health import FLEET_HEALTH_INTERVAL_SECONDS, fetch_fleet_health, run_fleet_health_job
+from services.retention import RETENTION_INTERVAL_SECONDS, run_retention_job
+from services.rollups import BUCKETS, fetch_rollups, run_rollup_flusher
+from services.realtime import SSESubscriber, Subscriber, hub, negotiate_delta, parse_resume_from
+from services.shared_state import open_shared_state
+from services.warmup import WarmUp
 from utils.auto_migrate import run_migrations
 
 
@@ -36,245 +57,115 @@ app.add_middleware(
 )
 
 vehicle_store: Dict[str, Dict[str, Any]] = {}
-ws_by_vehicle: Dict[str, list[WebSocket]] = {}
-ws_global: list[WebSocket] = []
-
-
-def _compute_status(
-    rpm: int, 
-    temp: int, 
-    dtc_code: str | None,
-    tps_percent: float | None,
-    batt_volt: float | None,
-    fuel_trim_short: float | None,
-) -> list[str]:
-    statuses: list[str] = []
-    critical = False
-    
-    if temp > 100:
-        statuses.append("OVERHEAT")
-        critical = True
-    if rpm > 6000:
-        statuses.append("OVERSPEED")
-    
-    if dtc_code:
-        critical = True
-        
-    if batt_volt is not None and batt_volt < 11.5:
-        statuses.append("LOW_BATTERY")
-        
-    if rpm < 1000 and tps_percent is not None and tps_percent > 5.0:
-        statuses.append("IDLE_TPS_ERROR")
-        
-    if fuel_trim_short is not None and (fuel_trim_short > 15.0 or fuel_trim_short < -15.0):
-        statuses.append("AFR_ISSUE")
-        
-    if critical:
-        statuses.append("CRITICAL")
-    if not statuses:
-        return ["NORMAL"]
-    return statuses
 
-@app.on_event("startup")
-async def startup():
-    await database.connect()
-    run_migrations() 
+# Tabel state terakhir di shared memory, dibaca semua worker uvicorn di host yang sama
+shared_state = open_shared_state()
 
-@app.on_event("shutdown")
-async def shutdown():
-    await database.disconnect()
+write_behind = WriteBehindSink(database) if WRITE_BEHIND else None
 
+pipeline = TelemetryPipeline(
+    dedup=ReplayDeduplicator(),
+    persist=write_behind or DatabaseSink(database),
+    publish=Publisher(vehicle_store, hub, shared_state),
+    analytics=analytics,
+)
 
-@app.post("/api/telemetry", response_model=TelemetryOut, tags=["Telemetry"])
-async def ingest_telemetry(payload: TelemetryIn):
-    statuses = _compute_status(
-        payload.rpm, 
-        payload.temp, 
-        payload.dtc_code,
-        payload.tps_percent,
-        payload.batt_volt,
-        payload.fuel_trim_short
-    )
+warmup = WarmUp(database, vehicle_store, shared=shared_state)
 
-    record = payload.dict(exclude_none=True)
-    record["timestamp"] = payload.timestamp.isoformat()
-    record["status"] = statuses
-
-    if ("CRITICAL" in statuses) or payload.dtc_code:
-        ai_result = analyze_damage(
-            payload.dtc_code,
-            payload.temp,
-            payload.vehicle_model,
-            payload.tps_percent, 
-            payload.batt_volt, 
-            payload.o2_volt, 
-            payload.map_kpa
-        )
-        record["ai_advice"] = ai_result
-    else:
-        record["ai_advice"] = None
-        
-    db_data = {
-        "vehicle_id": payload.vehicle_id,
-        "timestamp": payload.timestamp.replace(tzinfo=None),
-        "rpm": 0,
-        "temp": 0,
-        "dtc_code": None,
-        "tps_percent": None,
-        "batt_volt": None,
-        "fuel_trim_short": None,
-        "o2_volt": None,
-        "map_kpa": None,
-        "vehicle_model": None,
-        "status": statuses,
-        "ai_advice": None,
-    }
-
-    stmt = insert(TelemetryRecord).values(**db_data)
-    stmt = stmt.on_conflict_do_nothing(
-        index_elements=["vehicle_id"]
-    )
+# Mode urut: persist/publish per kendaraan berurutan, kendaraan berbeda bersamaan
+ingest = OrderedPipeline(pipeline) if INGEST_ORDERED else pipeline
 
-    await database.execute(stmt)
 
+# Batas laju per kendaraan/global dan request in-flight di depan endpoint ingest
+admission = AdmissionController()
 
-    vehicle_store[payload.vehicle_id] = record
+_background_tasks: list[asyncio.Task] = []
 
-    encoded = jsonable_encoder(record)
 
-    if payload.vehicle_id in ws_by_vehicle:
-        dead_ws = []
-        for ws in ws_by_vehicle[payload.vehicle_id]:
-            try:
-                await ws.send_json(encoded)
-            except:
-                dead_ws.append(ws)
-        for ws in dead_ws:
-            ws_by_vehicle[payload.vehicle_id].remove(ws)
+@app.on_event("startup")
+async def startup():
+    await database.connect()
+    if read_database is not database:
+        await read_database.connect()
+    run_migrations() 
+    load_analytics_snapshot(analytics)
+    # State terakhir dimuat di background; /ready menunggu warm-up (atau timeout)
+    _background_tasks.append(asyncio.create_task(warmup.run()))
+    if write_behind is not None:
+        await write_behind.recover()
+        _background_tasks.append(asyncio.create_task(write_behind.run()))
+    _background_tasks.append(asyncio.create_task(run_rollup_flusher(database)))
+    if ANALYTICS_SNAPSHOT_SECONDS > 0:
+        _background_tasks.append(asyncio.create_task(run_analytics_snapshots(analytics)))
+    if RETENTION_INTERVAL_SECONDS > 0:
+        _background_tasks.append(asyncio.create_task(run_retention_job(database)))
+    if FLEET_HEALTH_INTERVAL_SECONDS > 0:
+        _background_tasks.append(asyncio.create_task(run_fleet_health_job(database, read_database=read_database)))
 
-    dead_ws = []
-    for ws in ws_global:
-        try:
-            await ws.send_json(encoded)
-        except:
-            dead_ws.append(ws)
-    for ws in dead_ws:
-        ws_global.remove(ws)
+@app.on_event("shutdown")
+async def shutdown():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    if read_database is not database:
+        await read_database.disconnect()
+    await database.disconnect()
+    if shared_state is not None:
+        shared_state.close()
 
-    return encoded
 
-@app.post("/api/telemetry/db", response_model=TelemetryOut, tags=["Telemetry"])
-async def ingest_telemetry_db(payload: TelemetryIn):
-    statuses = _compute_status(
-        payload.rpm, 
-        payload.temp, 
+async def _admit_and_ingest(payload: TelemetryIn):
+    """Jalankan pipeline jika lolos admission control, selain itu 429 + Retry-After."""
+    statuses = compute_status(
+        payload.rpm,
+        payload.temp,
         payload.dtc_code,
         payload.tps_percent,
         payload.batt_volt,
         payload.fuel_trim_short
     )
-
-    record = payload.dict(exclude_none=True)
-    record["timestamp"] = payload.timestamp.isoformat()
-    record["status"] = statuses
-
-    ai_result = None
-    if ("CRITICAL" in statuses) or payload.dtc_code:
-        ai_result = analyze_damage(
-            payload.dtc_code,
-            payload.temp,
-            payload.vehicle_model,
-            payload.tps_percent, 
-            payload.batt_volt, 
-            payload.o2_volt, 
-            payload.map_kpa
+    rejected = admission.try_admit(payload.vehicle_id, priority=statuses != ["NORMAL"])
+    if rejected is not None:
+        reason, retry_after = rejected
+        raise HTTPException(
+            status_code=429,
+            detail=f"Ingest sedang penuh ({reason}), kirim ulang nanti",
+            headers={"Retry-After": str(retry_after)},
         )
+    try:
+        ctx = await ingest.run(payload)
+    except WriteBehindFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Database belum bisa menerima data, kirim ulang nanti",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    finally:
+        admission.release()
+    return ctx.encoded
 
-    ai_advice_dict = None
-    if ai_result:
-        if isinstance(ai_result, str):
-            try:
-                ai_advice_dict = json.loads(ai_result)
-            except:
-                ai_advice_dict = {"raw": ai_result}
-        else:
-            ai_advice_dict = ai_result
-
-    record["ai_advice"] = ai_advice_dict  
-
-    db_data = {
-        "vehicle_id": payload.vehicle_id,
-        "timestamp": payload.timestamp.replace(tzinfo=None),
-        "rpm": payload.rpm,
-        "temp": payload.temp,
-        "dtc_code": payload.dtc_code,
-        "tps_percent": payload.tps_percent,
-        "batt_volt": payload.batt_volt,
-        "fuel_trim_short": payload.fuel_trim_short,
-        "o2_volt": payload.o2_volt,
-        "map_kpa": payload.map_kpa,
-        "vehicle_model": payload.vehicle_model,
-        "status": statuses,
-        "ai_advice": ai_advice_dict,
-    }
-
-    existing = await database.fetch_one(
-        select(TelemetryRecord).where(TelemetryRecord.vehicle_id == payload.vehicle_id)
-    )
 
-    if existing:
-        query = (
-            TelemetryRecord
-            .__table__
-            .update()
-            .where(TelemetryRecord.vehicle_id == payload.vehicle_id)
-            .values(**db_data)
-        )
-    else:
-        query = TelemetryRecord.__table__.insert().values(**db_data)
-
-    await database.execute(query)
-
-    vehicle_store[payload.vehicle_id] = record
-    encoded = jsonable_encoder(record)
-
-    if payload.vehicle_id in ws_by_vehicle:
-        dead_ws = []
-        for ws in ws_by_vehicle[payload.vehicle_id]:
-            try:
-                await ws.send_json(encoded)
-            except:
-                dead_ws.append(ws)
-        for ws in dead_ws:
-            ws_by_vehicle[payload.vehicle_id].remove(ws)
-
-    # Send to global websocket
-    dead_ws = []
-    for ws in ws_global:
-        try:
-            await ws.send_json(encoded)
-        except:
-            dead_ws.append(ws)
-    for ws in dead_ws:
-        ws_global.remove(ws)
+@app.post("/api/telemetry", response_model=TelemetryOut, tags=["Telemetry"])
+async def ingest_telemetry(payload: TelemetryIn):
+    return await _admit_and_ingest(payload)
 
-    return encoded
+@app.post("/api/telemetry/db", response_model=TelemetryOut, tags=["Telemetry"])
+async def ingest_telemetry_db(payload: TelemetryIn):
+    return await _admit_and_ingest(payload)
 
 
 @app.get("/api/status/{vehicle_id}", response_model=TelemetryOut, tags=["Telemetry"])
 async def get_status(vehicle_id: str):
-    query = (
-        select(TelemetryRecord)
-        .where(TelemetryRecord.vehicle_id == vehicle_id)
-        .order_by(TelemetryRecord.timestamp.desc())
-        .limit(1)
-    )
-    record = await database.fetch_one(query)
+    if shared_state is not None:
+        cached = shared_state.get_bytes(vehicle_id)
+        if cached is not None:
+            # Record sudah ter-encode oleh pipeline; kirim apa adanya tanpa query database
+            return Response(content=cached, media_type="application/json")
 
-    if not record:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
+    record_dict = await STATUS_QUERY.fetch_one(read_database, vehicle_id=vehicle_id)
 
-    record_dict = dict(record)
+    if not record_dict:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
 
     if "speed" not in record_dict:
         record_dict["speed"] = 0.0  
@@ -296,44 +187,199 @@ async def list_vehicles():
 async def list_db_vehicles():
     """Mengembalikan daftar semua ID kendaraan unik dari database."""
     
-    query = select(TelemetryRecord.vehicle_id.distinct())
-    
-    results = await database.fetch_all(query)
+    results = await VEHICLE_IDS_QUERY.fetch_all(read_database)
     
     vehicle_ids = [r['vehicle_id'] for r in results]
     
     return vehicle_ids
 
 
+@app.get("/api/rollups/{vehicle_id}", tags=["Telemetry"])
+async def get_rollups(
+    vehicle_id: str,
+    bucket: str = "minute",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """Agregat min/max/avg temp, rpm, batt_volt dan jumlah status per menit/jam (terbaru dulu)."""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket harus salah satu dari {list(BUCKETS)}")
+    rows = await fetch_rollups(
+        read_database,
+        vehicle_id,
+        bucket,
+        start.replace(tzinfo=None) if start else None,
+        end.replace(tzinfo=None) if end else None,
+        limit,
+    )
+    return jsonable_encoder(rows)
+
+
+@app.get("/api/export", tags=["Telemetry"])
+async def export_telemetry(
+    vehicle_ids: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    format: str = "csv",
+):
+    """Ekspor riwayat telemetry (CSV/NDJSON/Parquet) secara streaming per chunk.
+
+    ``vehicle_ids`` dipisah koma; kosong berarti semua kendaraan.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format harus salah satu dari {list(EXPORT_FORMATS)}")
+    if format == "parquet" and pq is None:
+        raise HTTPException(status_code=400, detail="Format parquet membutuhkan pyarrow")
+
+    ids = [v.strip() for v in vehicle_ids.split(",") if v.strip()] if vehicle_ids else None
+    body = stream_export(
+        read_database,
+        format,
+        ids,
+        start.replace(tzinfo=None) if start else None,
+        end.replace(tzinfo=None) if end else None,
+    )
+    filename = f"telemetry_{datetime.utcnow():%Y%m%dT%H%M%S}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/fleet/health", tags=["Fleet"])
+async def get_fleet_health(
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Peringkat kendaraan yang paling perlu servis (skor terendah dulu), dari hasil job terjadwal."""
+    return jsonable_encoder(await fetch_fleet_health(read_database, limit, offset))
+
+
+def _check_analytics_window(hours: int) -> None:
+    if hours > ANALYTICS_RETENTION_HOURS:
+        raise HTTPException(status_code=400, detail=f"hours maksimal {ANALYTICS_RETENTION_HOURS} (retensi counter)")
+
+
+@app.get("/api/analytics/dtc", tags=["Analytics"])
+async def analytics_top_dtc(hours: int = Query(168, ge=1), limit: int = Query(10, ge=1, le=100)):
+    """Kode DTC paling sering dalam ``hours`` jam terakhir beserta rata-rata estimasi biaya."""
+    _check_analytics_window(hours)
+    return merged_counters(analytics).top_dtc(hours, limit)
+
+
+@app.get("/api/analytics/status", tags=["Analytics"])
+async def analytics_status(
+    hours: int = Query(168, ge=1),
+    group: str = "day",
+    status: str | None = None,
+    vehicle_model: str | None = None,
+):
+    """Jumlah sampel per status per vehicle_model per jam/hari, mis. ``status=CRITICAL&group=day``."""
+    _check_analytics_window(hours)
+    if group not in GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"group harus salah satu dari {list(GROUPINGS)}")
+    return jsonable_encoder(merged_counters(analytics).status_counts(hours, group, status, vehicle_model))
+
+
+@app.get("/api/analytics/costs", tags=["Analytics"])
+async def analytics_costs(hours: int = Query(168, ge=1)):
+    """Rata-rata dan total ``estimated_cost_idr`` dari saran AI per kode DTC."""
+    _check_analytics_window(hours)
+    return merged_counters(analytics).repair_costs(hours)
+
+
+@app.get("/api/metrics", tags=["Ops"])
+async def get_metrics():
+    """Counter dan durasi per stage pipeline ingest, serta statistik pool database."""
+    for name, db in (("primary", database), ("replica", read_database if read_database is not database else None)):
+        for key, value in (pool_stats(db) if db is not None else {}).items():
+            metrics.set_gauge(f"db.pool.{name}.{key}", value)
+    return metrics.snapshot()
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
-@app.websocket("/ws/{vehicle_id}")
-async def ws_vehicle(websocket: WebSocket, vehicle_id: str):
-    await websocket.accept()
-    ws_by_vehicle.setdefault(vehicle_id, []).append(websocket)
+@app.get("/ready", tags=["Ops"])
+async def ready():
+    """Readiness: 200 setelah warm-up vehicle_store selesai atau timeout, 503 selama warm-up."""
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
 
+def _load_state(vehicle_id: str | None = None) -> Dict[str, Dict[str, Any]]:
+    """State terkini dari vehicle_store (ter-encode) untuk snapshot realtime."""
+    if vehicle_id is None:
+        return {vid: jsonable_encoder(rec) for vid, rec in list(vehicle_store.items())}
     if vehicle_id in vehicle_store:
-        await websocket.send_json(jsonable_encoder(vehicle_store[vehicle_id]))
+        return {vehicle_id: jsonable_encoder(vehicle_store[vehicle_id])}
+    return {}
+
+
+@app.get("/api/events", tags=["Realtime"])
+async def stream_events(
+    request: Request,
+    resume_from: str | None = None,
+    vehicle_id: str | None = None,
+):
+    """Change feed Server-Sent Events; resume lewat header Last-Event-ID atau ?resume_from=<epoch>:<seq>."""
+    last_event_id = parse_resume_from(request.headers.get("last-event-id"))
+    start = last_event_id if last_event_id is not None else parse_resume_from(resume_from)
+
+    subscriber = SSESubscriber()
+    if vehicle_id:
+        subscriber.subscribe(vehicle_ids=[vehicle_id])
+    await hub.attach(subscriber, _load_state, resume_from=start)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    kind, event = await asyncio.wait_for(subscriber.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if kind == "close":
+                    break
+                yield SSESubscriber.format(kind, event)
+        finally:
+            hub.remove(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/{vehicle_id}")
+async def ws_vehicle(websocket: WebSocket, vehicle_id: str):
+    delta, subprotocol = negotiate_delta(websocket)
+    resume_from = parse_resume_from(websocket.query_params.get("resume_from"))
+    await websocket.accept(subprotocol=subprotocol)
+    subscriber = Subscriber(websocket, delta=delta, feed=resume_from is not None)
+    await hub.attach(subscriber, _load_state, vehicle_id, resume_from=resume_from)
 
     try:
         while True:
-            await websocket.receive_text()
+            subscriber.handle_message(await websocket.receive_text())
     except WebSocketDisconnect:
-        if vehicle_id in ws_by_vehicle and websocket in ws_by_vehicle[vehicle_id]:
-            ws_by_vehicle[vehicle_id].remove(websocket)
+        hub.remove(subscriber, vehicle_id)
 
 
 @app.websocket("/ws")
 async def ws_all(websocket: WebSocket):
-    await websocket.accept()
-    ws_global.append(websocket)
+    delta, subprotocol = negotiate_delta(websocket)
+    resume_from = parse_resume_from(websocket.query_params.get("resume_from"))
+    await websocket.accept(subprotocol=subprotocol)
+    subscriber = Subscriber(websocket, delta=delta, feed=resume_from is not None)
+    await hub.attach(subscriber, _load_state, resume_from=resume_from, snapshot=delta)
 
     try:
         while True:
-            await websocket.receive_text()
+            subscriber.handle_message(await websocket.receive_text())
     except WebSocketDisconnect:
-        if websocket in ws_global:
-            ws_global.remove(websocket)
+        hub.remove(subscriber)
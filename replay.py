@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+from services.metrics import metrics
+from services.pipeline import Publisher, TelemetryPipeline
+
+
+def load_payloads(path: str) -> list[dict]:
+    """Membaca traffic rekaman: satu payload TelemetryIn (JSON) per baris."""
+    payloads = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                print(f"Baris {line_no} dilewati: {e}")
+    return payloads
+
+
+async def replay(payloads: list[dict], pipeline: TelemetryPipeline, repeat: int = 1) -> dict:
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            try:
+                await pipeline.run(payload)
+            except Exception as e:
+                errors += 1
+                print(f"Gagal memproses {payload.get('vehicle_id')}: {e}")
+    elapsed = time.perf_counter() - start
+    total = len(payloads) * repeat
+    return {
+        "samples": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "samples_per_sec": round(total / elapsed, 1) if elapsed else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay traffic telemetry rekaman lewat TelemetryPipeline (tanpa HTTP)")
+    parser.add_argument("path", help="File JSONL, satu payload telemetry per baris")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-ai", action="store_true", help="Lewati stage enrich (tanpa panggilan AI)")
+    parser.add_argument("--dedup", action="store_true", help="Aktifkan stage dedup (paket duplikat dibuang)")
+    parser.add_argument("--with-db", action="store_true", help="Tulis ke DATABASE_URL lewat stage persist")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.path)
+    if not payloads:
+        print("Tidak ada payload untuk di-replay.")
+        sys.exit(1)
+
+    pipeline = TelemetryPipeline(publish=Publisher({}))
+    if args.no_ai:
+        pipeline.replace("enrich", None)
+    if args.dedup:
+        from services.dedup import ReplayDeduplicator
+
+        pipeline.replace("dedup", ReplayDeduplicator())
+
+    database = None
+    if args.with_db:
+        from database import database
+        from services.pipeline import DatabaseSink
+        from services.rollups import flush_rollups
+
+        await database.connect()
+        pipeline.replace("persist", DatabaseSink(database))
+
+    try:
+        result = await replay(payloads, pipeline, args.repeat)
+        if database is not None:
+            await flush_rollups(database)
+    finally:
+        if database is not None:
+            await database.disconnect()
+
+    print(json.dumps(result, indent=2))
+    snapshot = metrics.snapshot()
+    print(json.dumps(snapshot["timers"], indent=2))
+    if args.dedup:
+        print(json.dumps({k: v for k, v in snapshot["counters"].items() if k.startswith("dedup.")}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from services.metrics import metrics
+
+# Laju (sampel/detik) dan burst per kendaraan; 0 = tanpa batas per kendaraan
+ADMISSION_VEHICLE_RATE = float(os.getenv("ADMISSION_VEHICLE_RATE", "20"))
+ADMISSION_VEHICLE_BURST = float(os.getenv("ADMISSION_VEHICLE_BURST", "40"))
+# Laju dan burst seluruh armada; 0 = tanpa batas global
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", "2000"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "4000"))
+# Maksimal request ingest yang sedang diproses; 0 = tanpa batas
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "500"))
+# Porsi kapasitas (token dan slot in-flight) yang dicadangkan untuk sampel non-NORMAL
+ADMISSION_PRIORITY_RESERVE = float(os.getenv("ADMISSION_PRIORITY_RESERVE", "0.2"))
+# Jumlah bucket kendaraan yang diingat (LRU)
+ADMISSION_MAX_VEHICLES = int(os.getenv("ADMISSION_MAX_VEHICLES", "100000"))
+
+VEHICLE_RATE = "vehicle_rate"
+GLOBAL_RATE = "global_rate"
+INFLIGHT = "inflight"
+
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, rate: float, burst: float, now: float) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def retry_after(self, rate: float, floor: float) -> int:
+        """Detik sampai token kembali di atas ``floor`` (dibulatkan ke atas, minimal 1)."""
+        return max(1, math.ceil((floor + 1 - self.tokens) / rate))
+
+
+class AdmissionController:
+    """Admission control di depan endpoint ingest.
+
+    Sampel harus lolos tiga batas: token bucket per kendaraan, token bucket
+    global, dan jumlah request in-flight. Sampel NORMAL tidak boleh memakai
+    porsi ``priority_reserve`` terakhir dari setiap batas, sehingga saat
+    overload sampel NORMAL ditolak lebih dulu dan sampel dengan status lain
+    (OVERHEAT, CRITICAL, dst.) masih diterima.
+    """
+
+    def __init__(self, vehicle_rate: float = ADMISSION_VEHICLE_RATE, vehicle_burst: float = ADMISSION_VEHICLE_BURST,
+                 global_rate: float = ADMISSION_GLOBAL_RATE, global_burst: float = ADMISSION_GLOBAL_BURST,
+                 max_inflight: int = ADMISSION_MAX_INFLIGHT, priority_reserve: float = ADMISSION_PRIORITY_RESERVE,
+                 max_vehicles: int = ADMISSION_MAX_VEHICLES):
+        self.vehicle_rate = vehicle_rate
+        self.vehicle_burst = max(vehicle_burst, 1.0)
+        self.global_rate = global_rate
+        self.global_burst = max(global_burst, 1.0)
+        self.max_inflight = max_inflight
+        self.priority_reserve = priority_reserve
+        self.max_vehicles = max_vehicles
+        self.inflight = 0
+        self._vehicles: "OrderedDict[str, _TokenBucket]" = OrderedDict()
+        self._global = _TokenBucket(self.global_burst, time.monotonic())
+
+    def _vehicle_bucket(self, vehicle_id: str, now: float) -> _TokenBucket:
+        bucket = self._vehicles.get(vehicle_id)
+        if bucket is None:
+            bucket = self._vehicles[vehicle_id] = _TokenBucket(self.vehicle_burst, now)
+            if len(self._vehicles) > self.max_vehicles:
+                self._vehicles.popitem(last=False)
+        else:
+            self._vehicles.move_to_end(vehicle_id)
+        return bucket
+
+    def try_admit(self, vehicle_id: str, priority: bool) -> Optional[Tuple[str, int]]:
+        """None jika diterima (panggil ``release`` setelah selesai), atau ``(alasan, retry_after)``."""
+        kind = "priority" if priority else "normal"
+        reserve = 0.0 if priority else self.priority_reserve
+        now = time.monotonic()
+
+        vehicle = None
+        if self.vehicle_rate > 0:
+            vehicle = self._vehicle_bucket(vehicle_id, now)
+            vehicle.refill(self.vehicle_rate, self.vehicle_burst, now)
+            floor = self.vehicle_burst * reserve
+            if vehicle.tokens < floor + 1:
+                return self._shed(VEHICLE_RATE, kind, vehicle.retry_after(self.vehicle_rate, floor))
+
+        if self.global_rate > 0:
+            self._global.refill(self.global_rate, self.global_burst, now)
+            floor = self.global_burst * reserve
+            if self._global.tokens < floor + 1:
+                return self._shed(GLOBAL_RATE, kind, self._global.retry_after(self.global_rate, floor))
+
+        if self.max_inflight > 0 and self.inflight >= self.max_inflight * (1 - reserve):
+            return self._shed(INFLIGHT, kind, 1)
+
+        if vehicle is not None:
+            vehicle.tokens -= 1
+        if self.global_rate > 0:
+            self._global.tokens -= 1
+        self.inflight += 1
+        metrics.incr(f"admission.admitted.{kind}")
+        metrics.set_gauge("admission.inflight", self.inflight)
+        return None
+
+    def release(self) -> None:
+        self.inflight -= 1
+        metrics.set_gauge("admission.inflight", self.inflight)
+
+    def _shed(self, reason: str, kind: str, retry_after: int) -> Tuple[str, int]:
+        metrics.incr(f"admission.shed.{reason}.{kind}")
+        return reason, retry_after
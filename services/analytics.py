@@ -0,0 +1,381 @@
+import asyncio
+import calendar
+import json
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: tanpa flock hanya satu slot snapshot (satu worker)
+    fcntl = None
+
+from services.metrics import metrics
+from services.pipeline import PipelineContext
+
+# Lebar bucket waktu counter analitik (detik)
+ANALYTICS_BUCKET_SECONDS = int(os.getenv("ANALYTICS_BUCKET_SECONDS", "3600"))
+# Berapa lama bucket disimpan (jam); query tidak bisa melihat lebih jauh dari ini
+ANALYTICS_RETENTION_HOURS = int(os.getenv("ANALYTICS_RETENTION_HOURS", "192"))
+# File snapshot agar counter bertahan setelah restart; worker ke-n memakai <nama>.<n>.json
+ANALYTICS_SNAPSHOT_PATH = os.getenv("ANALYTICS_SNAPSHOT_PATH", "analytics_snapshot.json")
+# Jumlah maksimal slot snapshot (worker uvicorn per host)
+ANALYTICS_MAX_WORKERS = int(os.getenv("ANALYTICS_MAX_WORKERS", "64"))
+# Interval penulisan snapshot (detik); 0 = tanpa snapshot
+ANALYTICS_SNAPSHOT_SECONDS = float(os.getenv("ANALYTICS_SNAPSHOT_SECONDS", "60"))
+
+GROUPINGS = {"hour": 3600, "day": 86400}
+
+_SNAPSHOT_VERSION = 1
+
+
+def _epoch(ts: datetime) -> int:
+    """Detik epoch UTC; timestamp naive dianggap UTC seperti di database."""
+    return calendar.timegm(ts.utctimetuple())
+
+
+class _Bucket:
+    __slots__ = ("samples", "dtc", "status", "cost_sum", "cost_count")
+
+    def __init__(self):
+        self.samples = 0
+        self.dtc: Counter = Counter()
+        # (vehicle_model, status) -> jumlah sampel
+        self.status: Counter = Counter()
+        # Jumlah dan banyaknya estimated_cost_idr per kode DTC
+        self.cost_sum: Counter = Counter()
+        self.cost_count: Counter = Counter()
+
+    def merge(self, other: "_Bucket") -> None:
+        self.samples += other.samples
+        self.dtc.update(other.dtc)
+        self.status.update(other.status)
+        self.cost_sum.update(other.cost_sum)
+        self.cost_count.update(other.cost_count)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "dtc": dict(self.dtc),
+            "status": [[model, status, n] for (model, status), n in self.status.items()],
+            "cost_sum": dict(self.cost_sum),
+            "cost_count": dict(self.cost_count),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "_Bucket":
+        bucket = cls()
+        bucket.samples = int(data.get("samples", 0))
+        bucket.dtc.update(data.get("dtc", {}))
+        bucket.status.update({(model, status): n for model, status, n in data.get("status", [])})
+        bucket.cost_sum.update(data.get("cost_sum", {}))
+        bucket.cost_count.update(data.get("cost_count", {}))
+        return bucket
+
+
+class AnalyticsCounters:
+    """Counter sliding-window per bucket waktu, diperbarui di jalur ingest.
+
+    Query hanya menggabungkan bucket dalam window yang diminta, sehingga
+    biayanya tergantung jumlah bucket (maks ``retention / bucket_seconds``),
+    bukan jumlah baris telemetry. Bucket yang lebih tua dari retensi dibuang.
+    """
+
+    def __init__(self, bucket_seconds: int = ANALYTICS_BUCKET_SECONDS,
+                 retention_hours: int = ANALYTICS_RETENTION_HOURS):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention_hours * 3600
+        self.buckets: Dict[int, _Bucket] = {}
+
+    def _bucket_key(self, ts: datetime) -> int:
+        epoch = _epoch(ts)
+        return epoch - epoch % self.bucket_seconds
+
+    def _prune(self, now: int) -> None:
+        cutoff = now - self.retention
+        for key in [k for k in self.buckets if k < cutoff]:
+            del self.buckets[key]
+
+    def add(self, timestamp: datetime, vehicle_model: Optional[str], statuses: List[str],
+            dtc_code: Optional[str], estimated_cost_idr: Optional[int]) -> None:
+        key = self._bucket_key(timestamp)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            now = _epoch(datetime.utcnow())
+            if key < now - self.retention:
+                return
+            self._prune(now)
+            bucket = self.buckets[key] = _Bucket()
+
+        bucket.samples += 1
+        model = vehicle_model or "unknown"
+        for status in statuses:
+            bucket.status[(model, status)] += 1
+        if dtc_code:
+            code = dtc_code.upper()
+            bucket.dtc[code] += 1
+            if estimated_cost_idr:
+                bucket.cost_sum[code] += int(estimated_cost_idr)
+                bucket.cost_count[code] += 1
+
+    def __call__(self, ctx: PipelineContext) -> None:
+        payload = ctx.payload
+        advice = ctx.ai_advice if isinstance(ctx.ai_advice, dict) else {}
+        cost = advice.get("estimated_cost_idr")
+        self.add(
+            payload.timestamp.replace(tzinfo=None),
+            payload.vehicle_model,
+            ctx.statuses,
+            payload.dtc_code,
+            cost if isinstance(cost, (int, float)) else None,
+        )
+
+    def _window(self, hours: int):
+        end = _epoch(datetime.utcnow())
+        end -= end % self.bucket_seconds
+        start = end - hours * 3600
+        # Iterasi per bucket (bukan per baris) dari yang terlama
+        for key in range(start + self.bucket_seconds, end + self.bucket_seconds, self.bucket_seconds):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                yield key, bucket
+
+    def top_dtc(self, hours: int, limit: int = 10) -> List[Dict[str, Any]]:
+        counts: Counter = Counter()
+        cost_sum: Counter = Counter()
+        cost_count: Counter = Counter()
+        for _, bucket in self._window(hours):
+            counts.update(bucket.dtc)
+            cost_sum.update(bucket.cost_sum)
+            cost_count.update(bucket.cost_count)
+        return [
+            {
+                "dtc_code": code,
+                "count": n,
+                "avg_estimated_cost_idr": round(cost_sum[code] / cost_count[code]) if cost_count[code] else None,
+            }
+            for code, n in counts.most_common(limit)
+        ]
+
+    def status_counts(self, hours: int, group: str = "day", status: Optional[str] = None,
+                      vehicle_model: Optional[str] = None) -> List[Dict[str, Any]]:
+        width = GROUPINGS[group]
+        grouped: Counter = Counter()
+        for key, bucket in self._window(hours):
+            period = key - key % width
+            for (model, st), n in bucket.status.items():
+                if (status is None or st == status) and (vehicle_model is None or model == vehicle_model):
+                    grouped[(period, model, st)] += n
+        return [
+            {
+                "period_start": datetime.utcfromtimestamp(period),
+                "vehicle_model": model,
+                "status": st,
+                "count": n,
+            }
+            for (period, model, st), n in sorted(grouped.items())
+        ]
+
+    def repair_costs(self, hours: int) -> List[Dict[str, Any]]:
+        cost_sum: Counter = Counter()
+        cost_count: Counter = Counter()
+        for _, bucket in self._window(hours):
+            cost_sum.update(bucket.cost_sum)
+            cost_count.update(bucket.cost_count)
+        rows = [
+            {
+                "dtc_code": code,
+                "avg_estimated_cost_idr": round(cost_sum[code] / n),
+                "total_estimated_cost_idr": cost_sum[code],
+                "samples": n,
+            }
+            for code, n in cost_count.items() if n
+        ]
+        rows.sort(key=lambda r: r["avg_estimated_cost_idr"], reverse=True)
+        return rows
+
+    def merge(self, other: "AnalyticsCounters") -> None:
+        for key, bucket in other.buckets.items():
+            mine = self.buckets.get(key)
+            if mine is None:
+                mine = self.buckets[key] = _Bucket()
+            mine.merge(bucket)
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {
+            "version": _SNAPSHOT_VERSION,
+            "bucket_seconds": self.bucket_seconds,
+            "saved_at": datetime.utcnow().isoformat(),
+            "buckets": {str(k): b.to_dict() for k, b in self.buckets.items()},
+        }
+
+    def load_snapshot(self, data: Dict[str, Any]) -> int:
+        if data.get("version") != _SNAPSHOT_VERSION or data.get("bucket_seconds") != self.bucket_seconds:
+            print("Analytics snapshot ignored: incompatible version or bucket size.")
+            return 0
+        for key, raw in data.get("buckets", {}).items():
+            self.buckets[int(key)] = _Bucket.from_dict(raw)
+        self._prune(_epoch(datetime.utcnow()))
+        return len(self.buckets)
+
+
+def _write_snapshot_atomic(path: str, data: Dict[str, Any]) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    tmpfd, tmppath = tempfile.mkstemp(prefix="analytics_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(tmpfd, "w", encoding="utf-8") as tf:
+            json.dump(data, tf, ensure_ascii=False)
+            tf.flush()
+            os.fsync(tf.fileno())
+        os.replace(tmppath, path)
+    except Exception as e:
+        print(f"Failed to write analytics snapshot atomically: {e}")
+        try:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        except Exception:
+            pass
+
+
+def _read_snapshot(counters: "AnalyticsCounters", path: str) -> int:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return counters.load_snapshot(json.load(f))
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        print(f"Failed to read analytics snapshot {path}: {e}")
+        return 0
+
+
+class SnapshotSlots:
+    """Satu file snapshot per worker, digabung saat dibaca.
+
+    Setiap worker mengklaim slot pertama yang bebas (``flock`` pada file
+    ``.lock`` slot, dipegang selama proses hidup) lalu hanya menulis ke file
+    slotnya sendiri. Slot 0 memakai ``path`` apa adanya, slot lain
+    ``<nama>.<n><ext>``. Setelah restart dengan jumlah worker yang sama,
+    setiap slot diklaim lagi dan dimuat oleh satu worker, sehingga tidak ada
+    counter yang hilang atau terhitung dua kali. Snapshot slot worker lain
+    (termasuk slot yatim dari worker yang sudah tidak ada) digabung ke hasil
+    query, di-cache sampai file berubah.
+    """
+
+    def __init__(self, path: str = ANALYTICS_SNAPSHOT_PATH, max_slots: int = ANALYTICS_MAX_WORKERS):
+        self.path = path
+        self.max_slots = max(max_slots, 1) if fcntl is not None else 1
+        self.slot: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._peer_key: Optional[Tuple] = None
+        self._peers: Optional[AnalyticsCounters] = None
+
+    def slot_path(self, slot: int) -> str:
+        if slot == 0:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{slot}{ext}"
+
+    @property
+    def own_path(self) -> str:
+        return self.slot_path(self.slot or 0)
+
+    def claim(self) -> int:
+        if self.slot is not None:
+            return self.slot
+        if fcntl is None:
+            self.slot = 0
+            return self.slot
+        for slot in range(self.max_slots):
+            fd = os.open(f"{self.slot_path(slot)}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            self._lock_fd = fd
+            self.slot = slot
+            return slot
+        raise RuntimeError(f"Semua {self.max_slots} slot snapshot analitik dipakai (ANALYTICS_MAX_WORKERS)")
+
+    def release(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def peers(self, template: "AnalyticsCounters") -> Optional["AnalyticsCounters"]:
+        """Gabungan snapshot slot lain, atau None jika tidak ada."""
+        files = []
+        for slot in range(self.max_slots):
+            if slot == self.slot:
+                continue
+            path = self.slot_path(slot)
+            try:
+                files.append((path, os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                continue
+        key = tuple(files)
+        if key != self._peer_key:
+            merged = AnalyticsCounters(template.bucket_seconds, template.retention // 3600)
+            loaded = 0
+            for path, _ in files:
+                peer = AnalyticsCounters(template.bucket_seconds, template.retention // 3600)
+                loaded += _read_snapshot(peer, path)
+                merged.merge(peer)
+            self._peer_key = key
+            self._peers = merged if loaded else None
+        return self._peers
+
+
+def load_analytics_snapshot(counters: "AnalyticsCounters", slots: Optional["SnapshotSlots"] = None) -> int:
+    """Mengklaim slot snapshot worker ini dan memuat isinya ke ``counters``."""
+    slots = slots or snapshot_slots
+    slots.claim()
+    if not os.path.exists(slots.own_path):
+        return 0
+    loaded = _read_snapshot(counters, slots.own_path)
+    print(f"Analytics snapshot loaded: {loaded} buckets (slot {slots.slot}).")
+    return loaded
+
+
+def merged_counters(counters: "AnalyticsCounters", slots: Optional["SnapshotSlots"] = None) -> "AnalyticsCounters":
+    """Counter live worker ini ditambah snapshot worker lain, untuk menjawab query analitik."""
+    slots = slots or snapshot_slots
+    if slots.slot is None:
+        return counters
+    peers = slots.peers(counters)
+    if peers is None:
+        return counters
+    merged = AnalyticsCounters(counters.bucket_seconds, counters.retention // 3600)
+    merged.merge(peers)
+    merged.merge(counters)
+    return merged
+
+
+async def save_analytics_snapshot(counters: "AnalyticsCounters", slots: Optional["SnapshotSlots"] = None) -> None:
+    # Serialisasi di event loop (tidak ada ingest yang mengubah counter di tengah), tulis file di thread
+    slots = slots or snapshot_slots
+    data = counters.to_snapshot()
+    await asyncio.to_thread(_write_snapshot_atomic, slots.own_path, data)
+    metrics.incr("analytics.snapshots")
+
+
+async def run_analytics_snapshots(counters: "AnalyticsCounters", slots: Optional["SnapshotSlots"] = None,
+                                  interval: float = ANALYTICS_SNAPSHOT_SECONDS) -> None:
+    """Background task: tulis snapshot setiap ``interval`` detik dan sekali lagi saat di-cancel."""
+    slots = slots or snapshot_slots
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await save_analytics_snapshot(counters, slots)
+            except Exception as e:
+                print(f"Analytics snapshot failed: {e}")
+    finally:
+        _write_snapshot_atomic(slots.own_path, counters.to_snapshot())
+        slots.release()
+
+
+analytics = AnalyticsCounters()
+snapshot_slots = SnapshotSlots()
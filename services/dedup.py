@@ -0,0 +1,94 @@
+import os
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional
+
+from services.metrics import metrics
+from services.pipeline import PipelineContext
+
+# Jumlah timestamp terakhir per kendaraan yang diingat untuk deteksi duplikat
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "64"))
+# Jumlah kendaraan yang dilacak (LRU); kendaraan tertua dilupakan
+DEDUP_MAX_VEHICLES = int(os.getenv("DEDUP_MAX_VEHICLES", "100000"))
+
+DUPLICATE = "duplicate"
+OUT_OF_ORDER = "out_of_order"
+
+
+class _VehicleWindow:
+    __slots__ = ("seen", "order", "latest")
+
+    def __init__(self, size: int):
+        self.seen: set[datetime] = set()
+        self.order: deque[datetime] = deque(maxlen=size)
+        self.latest: Optional[datetime] = None
+
+    def add(self, ts: datetime) -> None:
+        if len(self.order) == self.order.maxlen:
+            self.seen.discard(self.order[0])
+        self.order.append(ts)
+        self.seen.add(ts)
+        if self.latest is None or ts > self.latest:
+            self.latest = ts
+
+    def discard(self, ts: datetime) -> None:
+        if ts not in self.seen:
+            return
+        self.seen.discard(ts)
+        self.order.remove(ts)
+        if ts == self.latest:
+            self.latest = max(self.order, default=None)
+
+
+class ReplayDeduplicator:
+    """Stage dedup: mengenali paket retransmisi ``(vehicle_id, timestamp)``.
+
+    Duplikat dihentikan sebelum AI, database dan WebSocket. Paket yang lebih
+    lama dari state terakhir kendaraan ditandai ``ctx.stale``: tetap masuk
+    riwayat, tetapi tidak menimpa state terakhir dan tidak di-broadcast.
+    Timestamp langsung dicatat agar retransmisi yang datang bersamaan tetap
+    dikenali, lalu dihapus lagi jika stage berikutnya (mis. persist) gagal
+    sehingga retry dari device tidak dianggap duplikat.
+    """
+
+    def __init__(self, window: int = DEDUP_WINDOW, max_vehicles: int = DEDUP_MAX_VEHICLES):
+        self.window = window
+        self.max_vehicles = max_vehicles
+        self._vehicles: "OrderedDict[str, _VehicleWindow]" = OrderedDict()
+
+    def check(self, vehicle_id: str, timestamp: datetime) -> Optional[str]:
+        """Mengembalikan ``DUPLICATE``, ``OUT_OF_ORDER`` atau None, lalu mencatat timestamp."""
+        win = self._vehicles.get(vehicle_id)
+        if win is None:
+            win = self._vehicles[vehicle_id] = _VehicleWindow(self.window)
+            if len(self._vehicles) > self.max_vehicles:
+                self._vehicles.popitem(last=False)
+        else:
+            self._vehicles.move_to_end(vehicle_id)
+
+        if timestamp in win.seen:
+            return DUPLICATE
+        verdict = OUT_OF_ORDER if win.latest is not None and timestamp < win.latest else None
+        win.add(timestamp)
+        return verdict
+
+    def forget(self, vehicle_id: str, timestamp: datetime) -> None:
+        """Menghapus timestamp yang sudah dicatat ``check`` (sampel gagal diproses)."""
+        win = self._vehicles.get(vehicle_id)
+        if win is not None:
+            win.discard(timestamp)
+
+    def __call__(self, ctx: PipelineContext) -> None:
+        vehicle_id = ctx.payload.vehicle_id
+        timestamp = ctx.payload.timestamp.replace(tzinfo=None)
+        verdict = self.check(vehicle_id, timestamp)
+        if verdict == DUPLICATE:
+            metrics.incr("dedup.duplicate")
+            ctx.drop(DUPLICATE)
+            return
+        ctx.on_failure(lambda: self.forget(vehicle_id, timestamp))
+        if verdict == OUT_OF_ORDER:
+            metrics.incr("dedup.out_of_order")
+            ctx.stale = True
+        else:
+            metrics.incr("dedup.accepted")
@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.sql import select
+
+from database import TelemetrySample
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Jumlah baris per chunk yang di-stream ke klien (dan per row group Parquet)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+EXPORT_COLUMNS = (
+    "vehicle_id", "timestamp", "rpm", "speed", "temp", "dtc_code",
+    "tps_percent", "batt_volt", "fuel_trim_short", "o2_volt", "map_kpa",
+    "vehicle_model", "status", "ai_advice",
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_query(vehicle_ids: Optional[List[str]], start: Optional[datetime], end: Optional[datetime]):
+    table = TelemetrySample.__table__
+    conditions = []
+    if vehicle_ids:
+        conditions.append(table.c.vehicle_id.in_(vehicle_ids))
+    if start is not None:
+        conditions.append(table.c.timestamp >= start)
+    if end is not None:
+        conditions.append(table.c.timestamp < end)
+    query = select(*[table.c[name] for name in EXPORT_COLUMNS])
+    if conditions:
+        query = query.where(and_(*conditions))
+    return query.order_by(table.c.vehicle_id, table.c.timestamp)
+
+
+async def _iter_chunks(database, query, chunk_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Membaca hasil query lewat server-side cursor (``database.iterate``) per chunk tetap."""
+    chunk: List[Dict[str, Any]] = []
+    async for row in database.iterate(query):
+        chunk.append({name: row[name] for name in EXPORT_COLUMNS})
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _stream_ndjson(chunks: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield "".join(
+            json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in chunk
+        ).encode("utf-8")
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+async def _stream_csv(chunks: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    async for chunk in chunks:
+        for row in chunk:
+            writer.writerow([_csv_value(row[name]) for name in EXPORT_COLUMNS])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """File-like tujuan ParquetWriter yang menampung byte sampai diambil dengan ``take``."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("vehicle_id", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("rpm", pa.int32()),
+        ("speed", pa.int32()),
+        ("temp", pa.int32()),
+        ("dtc_code", pa.string()),
+        ("tps_percent", pa.float64()),
+        ("batt_volt", pa.float64()),
+        ("fuel_trim_short", pa.float64()),
+        ("o2_volt", pa.float64()),
+        ("map_kpa", pa.float64()),
+        ("vehicle_model", pa.string()),
+        ("status", pa.list_(pa.string())),
+        ("ai_advice", pa.string()),
+    ])
+
+
+async def _stream_parquet(chunks: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for chunk in chunks:
+            columns = {name: [row[name] for row in chunk] for name in EXPORT_COLUMNS}
+            columns["ai_advice"] = [
+                json.dumps(v, ensure_ascii=False) if v is not None else None for v in columns["ai_advice"]
+            ]
+            # Satu chunk = satu row group, sehingga memori tetap sebesar satu chunk
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_export(database, fmt: str, vehicle_ids: Optional[List[str]] = None,
+                  start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Generator byte untuk StreamingResponse ekspor telemetry_samples."""
+    chunks = _iter_chunks(database, export_query(vehicle_ids, start, end), chunk_size)
+    if fmt == "csv":
+        return _stream_csv(chunks)
+    if fmt == "ndjson":
+        return _stream_ndjson(chunks)
+    if fmt == "parquet":
+        if pq is None:
+            raise RuntimeError("pyarrow tidak terpasang; format parquet tidak tersedia")
+        return _stream_parquet(chunks)
+    raise ValueError(f"Format ekspor tidak dikenal: {fmt}")
@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+import numpy as np
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import select
+
+from database import FleetHealth, TelemetrySample
+from services.metrics import metrics
+
+# Interval job skor kesehatan armada (detik); 0 = job tidak dijalankan di server
+FLEET_HEALTH_INTERVAL_SECONDS = float(os.getenv("FLEET_HEALTH_INTERVAL_SECONDS", "3600"))
+# Rentang riwayat yang dinilai (hari)
+FLEET_HEALTH_WINDOW_DAYS = int(os.getenv("FLEET_HEALTH_WINDOW_DAYS", "7"))
+# Jumlah sampel yang dimuat ke array NumPy per batch (batch selalu berisi kendaraan utuh)
+FLEET_HEALTH_BATCH_ROWS = int(os.getenv("FLEET_HEALTH_BATCH_ROWS", "200000"))
+
+# Sama dengan ambang OVERHEAT di compute_status
+OVERHEAT_TEMP = 100
+
+# Bobot penalti per sinyal (total 100) dan nilai sinyal yang dianggap penalti penuh
+WEIGHTS = {"overheat": 30.0, "battery": 20.0, "fuel_trim": 15.0, "dtc": 20.0, "ai_urgency": 15.0}
+OVERHEAT_RATE_FULL = 0.2      # 20% sampel overheat
+BATTERY_DROP_FULL = 0.1       # turun 0,1 V per hari
+FUEL_TRIM_DRIFT_FULL = 15.0   # rata-rata fuel trim +/-15%
+DTC_DAYS_FULL = 4             # kode DTC yang sama muncul di 4 hari berbeda
+
+URGENCY_LEVELS = {"rendah": 0.0, "low": 0.0, "sedang": 0.5, "medium": 0.5, "tinggi": 1.0, "high": 1.0}
+
+_UPSERT_BATCH = 500
+
+# Kunci pg_advisory_lock agar hanya satu worker/proses yang menghitung skor
+_LOCK_KEY = 0x0F1EE7
+
+
+def _urgency(ai_advice: Any) -> float:
+    if isinstance(ai_advice, str):
+        try:
+            ai_advice = json.loads(ai_advice)
+        except ValueError:
+            return np.nan
+    if not isinstance(ai_advice, dict):
+        return np.nan
+    return URGENCY_LEVELS.get(str(ai_advice.get("urgency", "")).strip().lower(), np.nan)
+
+
+def _group_mean(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Rata-rata per kendaraan dengan NaN diabaikan (NaN jika tidak ada nilai)."""
+    valid = ~np.isnan(values)
+    n = np.add.reduceat(valid.astype(np.float64), starts)
+    total = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, total / n, np.nan)
+
+
+def score_vehicles(vehicle_ids: np.ndarray, days: np.ndarray, temp: np.ndarray, batt_volt: np.ndarray,
+                   fuel_trim: np.ndarray, dtc_codes: np.ndarray, urgency: np.ndarray) -> List[Dict[str, Any]]:
+    """Menghitung sinyal dan skor untuk semua kendaraan dalam satu batch sekaligus.
+
+    Semua array sejajar satu elemen per sampel dan terurut per ``vehicle_id``
+    (lalu waktu). ``days`` adalah waktu sampel dalam hari sejak awal window;
+    nilai kosong diisi NaN (``dtc_codes``: None).
+    """
+    n_rows = len(vehicle_ids)
+    if n_rows == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, vehicle_ids[1:] != vehicle_ids[:-1]])
+    counts = np.diff(np.r_[starts, n_rows])
+    vidx = np.repeat(np.arange(len(starts)), counts)
+
+    overheat_rate = np.add.reduceat((temp > OVERHEAT_TEMP).astype(np.float64), starts) / counts
+
+    # Tren baterai: kemiringan regresi linear volt terhadap hari (bentuk tertutup per kendaraan)
+    valid = ~np.isnan(batt_volt)
+    x = np.where(valid, days, 0.0)
+    y = np.where(valid, batt_volt, 0.0)
+    n = np.add.reduceat(valid.astype(np.float64), starts)
+    sx = np.add.reduceat(x, starts)
+    sy = np.add.reduceat(y, starts)
+    sxx = np.add.reduceat(x * x, starts)
+    sxy = np.add.reduceat(x * y, starts)
+    denom = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        battery_trend = np.where((n >= 2) & (denom > 1e-9), (n * sxy - sx * sy) / denom, np.nan)
+
+    fuel_trim_drift = np.abs(_group_mean(fuel_trim, starts))
+    ai_urgency = _group_mean(urgency, starts)
+
+    # Rekurensi DTC: jumlah hari berbeda kode yang sama muncul, diambil kode terburuk per kendaraan
+    dtc_recurrence = np.zeros(len(starts), dtype=np.int64)
+    top_dtc: List[Optional[str]] = [None] * len(starts)
+    has_dtc = np.not_equal(dtc_codes, None)
+    if has_dtc.any():
+        codes, code_idx = np.unique(dtc_codes[has_dtc].astype(str), return_inverse=True)
+        day_idx = np.floor(days[has_dtc]).astype(np.int64)
+        day_idx -= day_idx.min()
+        n_days = int(day_idx.max()) + 1
+        pair = vidx[has_dtc] * len(codes) + code_idx
+        # Satu entri per (kendaraan, kode, hari), lalu hitung hari per (kendaraan, kode)
+        pairs = np.unique(pair * n_days + day_idx) // n_days
+        pair_keys, pair_days = np.unique(pairs, return_counts=True)
+        owner = pair_keys // len(codes)
+        order = np.lexsort((pair_days, owner))
+        last = np.r_[owner[order][1:] != owner[order][:-1], True]
+        for k in order[last]:
+            dtc_recurrence[owner[k]] = pair_days[k]
+            top_dtc[owner[k]] = str(codes[pair_keys[k] % len(codes)])
+
+    penalty = (
+        WEIGHTS["overheat"] * np.clip(overheat_rate / OVERHEAT_RATE_FULL, 0, 1)
+        + WEIGHTS["battery"] * np.clip(np.nan_to_num(-battery_trend) / BATTERY_DROP_FULL, 0, 1)
+        + WEIGHTS["fuel_trim"] * np.clip(np.nan_to_num(fuel_trim_drift) / FUEL_TRIM_DRIFT_FULL, 0, 1)
+        + WEIGHTS["dtc"] * np.clip(dtc_recurrence / DTC_DAYS_FULL, 0, 1)
+        + WEIGHTS["ai_urgency"] * np.nan_to_num(ai_urgency)
+    )
+    score = np.clip(100.0 - penalty, 0, 100)
+
+    def opt(value: float, digits: int) -> Optional[float]:
+        return None if np.isnan(value) else round(float(value), digits)
+
+    return [
+        {
+            "vehicle_id": str(vehicle_ids[s]),
+            "score": round(float(score[i]), 1),
+            "sample_count": int(counts[i]),
+            "overheat_rate": round(float(overheat_rate[i]), 4),
+            "battery_trend": opt(battery_trend[i], 4),
+            "fuel_trim_drift": opt(fuel_trim_drift[i], 2),
+            "dtc_recurrence": int(dtc_recurrence[i]),
+            "top_dtc_code": top_dtc[i],
+            "ai_urgency": opt(ai_urgency[i], 3),
+        }
+        for i, s in enumerate(starts)
+    ]
+
+
+class _Batch:
+    """Kolom sampel yang sedang dimuat, dikonversi ke array NumPy saat batch diproses."""
+
+    def __init__(self, window_start: datetime):
+        self.window_start = window_start
+        self.clear()
+
+    def clear(self) -> None:
+        self.vehicle_ids: List[str] = []
+        self.days: List[float] = []
+        self.temp: List[float] = []
+        self.batt_volt: List[float] = []
+        self.fuel_trim: List[float] = []
+        self.dtc_codes: List[Optional[str]] = []
+        self.urgency: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.vehicle_ids)
+
+    def add(self, r) -> None:
+        self.vehicle_ids.append(r["vehicle_id"])
+        self.days.append((r["timestamp"] - self.window_start).total_seconds() / 86400)
+        self.temp.append(r["temp"])
+        self.batt_volt.append(np.nan if r["batt_volt"] is None else r["batt_volt"])
+        self.fuel_trim.append(np.nan if r["fuel_trim_short"] is None else r["fuel_trim_short"])
+        self.dtc_codes.append(r["dtc_code"] or None)
+        self.urgency.append(_urgency(r["ai_advice"]))
+
+    def score(self) -> List[Dict[str, Any]]:
+        return score_vehicles(
+            np.array(self.vehicle_ids, dtype=object),
+            np.array(self.days, dtype=np.float64),
+            np.array(self.temp, dtype=np.float64),
+            np.array(self.batt_volt, dtype=np.float64),
+            np.array(self.fuel_trim, dtype=np.float64),
+            np.array(self.dtc_codes, dtype=object),
+            np.array(self.urgency, dtype=np.float64),
+        )
+
+
+async def _store(database, results: List[Dict[str, Any]], window_start: datetime, computed_at: datetime) -> None:
+    table = FleetHealth.__table__
+    for i in range(0, len(results), _UPSERT_BATCH):
+        rows = [
+            {**r, "window_start": window_start, "computed_at": computed_at}
+            for r in results[i:i + _UPSERT_BATCH]
+        ]
+        stmt = insert(table).values(rows)
+        await database.execute(stmt.on_conflict_do_update(
+            index_elements=["vehicle_id"],
+            set_={c: stmt.excluded[c] for c in rows[0] if c != "vehicle_id"},
+        ))
+
+
+async def _window_pages(read_database, window_start: datetime, page_rows: int):
+    """Sampel dalam window terurut (vehicle_id, timestamp, id), dibaca per halaman keyset.
+
+    Tidak memakai cursor ``iterate``: skor ditulis di antara halaman, dan tanpa
+    replica ``read_database`` adalah database utama yang koneksinya tidak bisa
+    menjalankan query lain selama cursor masih terbuka.
+    """
+    samples = TelemetrySample.__table__
+    key = (samples.c.vehicle_id, samples.c.timestamp, samples.c.id)
+    query = select(
+        samples.c.id, samples.c.vehicle_id, samples.c.timestamp, samples.c.temp, samples.c.batt_volt,
+        samples.c.fuel_trim_short, samples.c.dtc_code, samples.c.ai_advice,
+    ).where(samples.c.timestamp >= window_start).order_by(*key).limit(page_rows)
+    after = None
+    while True:
+        rows = await read_database.fetch_all(query if after is None else query.where(tuple_(*key) > tuple_(*after)))
+        if rows:
+            yield rows
+        if len(rows) < page_rows:
+            return
+        last = rows[-1]
+        after = (last["vehicle_id"], last["timestamp"], last["id"])
+
+
+async def _score_window(database, read_database, window_days: int, batch_rows: int) -> int:
+    start = time.perf_counter()
+    computed_at = datetime.utcnow()
+    window_start = computed_at - timedelta(days=window_days)
+
+    batch = _Batch(window_start)
+    scored = 0
+    async for page in _window_pages(read_database, window_start, batch_rows):
+        for r in page:
+            # Potong batch hanya di batas kendaraan agar satu kendaraan tidak terbelah
+            if len(batch) >= batch_rows and r["vehicle_id"] != batch.vehicle_ids[-1]:
+                results = batch.score()
+                await _store(database, results, window_start, computed_at)
+                scored += len(results)
+                batch.clear()
+            batch.add(r)
+    results = batch.score()
+    await _store(database, results, window_start, computed_at)
+    scored += len(results)
+
+    table = FleetHealth.__table__
+    await database.execute(table.delete().where(table.c.computed_at < computed_at))
+
+    metrics.observe("fleet_health.job", time.perf_counter() - start)
+    metrics.set_gauge("fleet_health.vehicles", scored)
+    return scored
+
+
+async def compute_fleet_health(database, window_days: int = FLEET_HEALTH_WINDOW_DAYS,
+                               batch_rows: int = FLEET_HEALTH_BATCH_ROWS, read_database=None) -> Optional[int]:
+    """Menilai semua kendaraan yang punya sampel dalam window dan menyimpan hasilnya ke fleet_health.
+
+    Sampel dibaca dari ``read_database`` (replica, jika ada) dan skor ditulis
+    ke ``database``. Di PostgreSQL hanya satu proses yang menghitung
+    (advisory lock); proses lain mendapat None. Kendaraan tanpa sampel dalam
+    window dihapus dari tabel. Mengembalikan jumlah kendaraan yang dinilai.
+    """
+    read_database = read_database or database
+    if database.url.dialect != "postgresql":
+        return await _score_window(database, read_database, window_days, batch_rows)
+
+    async with database.connection() as connection:
+        if not await connection.fetch_val("SELECT pg_try_advisory_lock(:key)", {"key": _LOCK_KEY}):
+            metrics.incr("fleet_health.skipped_locked")
+            return None
+        try:
+            return await _score_window(connection, read_database, window_days, batch_rows)
+        finally:
+            await connection.fetch_val("SELECT pg_advisory_unlock(:key)", {"key": _LOCK_KEY})
+
+
+async def run_fleet_health_job(database, interval: float = FLEET_HEALTH_INTERVAL_SECONDS, read_database=None) -> None:
+    """Background job: hitung skor saat startup lalu setiap ``interval`` detik sampai di-cancel."""
+    while True:
+        try:
+            scored = await compute_fleet_health(database, read_database=read_database)
+            if scored is not None:
+                print(f"Fleet health: {scored} vehicles scored.")
+        except Exception as e:
+            metrics.incr("fleet_health.errors")
+            print(f"Fleet health job failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def fetch_fleet_health(database, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+    """Daftar skor terurut dari yang paling perlu servis (skor terendah)."""
+    table = FleetHealth.__table__
+    total = await database.fetch_val(select(func.count()).select_from(table))
+    query = select(table).order_by(table.c.score, table.c.vehicle_id).limit(limit).offset(offset)
+    rows = await database.fetch_all(query)
+    return {
+        "total": total or 0,
+        "limit": limit,
+        "offset": offset,
+        "items": [dict(r) for r in rows],
+    }
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="Skor kesehatan armada")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Hitung ulang skor sekali lalu keluar")
+    run.add_argument("--window-days", type=int, default=FLEET_HEALTH_WINDOW_DAYS)
+    args = parser.parse_args()
+
+    from database import database, read_database
+
+    await database.connect()
+    if read_database is not database:
+        await read_database.connect()
+    try:
+        if args.command == "run":
+            scored = await compute_fleet_health(database, args.window_days, read_database=read_database)
+            if scored is None:
+                print("Fleet health dilewati: sedang dihitung proses lain.")
+            else:
+                print(f"Fleet health selesai: {scored} kendaraan dinilai.")
+    finally:
+        if read_database is not database:
+            await read_database.disconnect()
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,61 @@
+import asyncio
+import os
+from typing import Any, Dict, Union
+
+from models import TelemetryIn
+from services.metrics import metrics
+from services.pipeline import PipelineContext, TelemetryPipeline
+
+# Mode urut per kendaraan: sampel satu kendaraan disimpan/dipublish sesuai urutan kedatangan
+INGEST_ORDERED = os.getenv("INGEST_ORDERED", "0") == "1"
+
+# Stage sampai enrich dijalankan langsung (paralel); mulai persist berurutan per kendaraan
+_CONCURRENT_UNTIL = "enrich"
+_ORDERED_FROM = "persist"
+
+
+def _vehicle_id(raw: Union[TelemetryIn, Dict[str, Any]]) -> str:
+    return raw.vehicle_id if isinstance(raw, TelemetryIn) else str(raw.get("vehicle_id", ""))
+
+
+class OrderedPipeline:
+    """Menjalankan ``TelemetryPipeline`` dengan persist/publish/analytics berurutan per ``vehicle_id``.
+
+    Stage validate..enrich (termasuk panggilan AI) berjalan langsung di
+    request, paralel untuk semua sampel. Stage selanjutnya menunggu giliran
+    kendaraannya: sampel berikutnya dari kendaraan yang sama baru disimpan
+    setelah persist/publish/analytics sampel sebelumnya selesai, sehingga
+    tidak saling mendahului. Kendaraan berbeda tetap berjalan bersamaan di
+    event loop; skala antar core didapat dari beberapa worker uvicorn.
+    """
+
+    def __init__(self, pipeline: TelemetryPipeline):
+        self.pipeline = pipeline
+        # Per kendaraan: future yang selesai saat sampel terakhirnya selesai diproses
+        self._tails: Dict[str, asyncio.Future] = {}
+
+    async def run(self, raw: Union[TelemetryIn, Dict[str, Any]]) -> PipelineContext:
+        """Jalankan stage awal, tunggu giliran kendaraan, lalu jalankan stage berurutan."""
+        vehicle_id = _vehicle_id(raw)
+        previous = self._tails.get(vehicle_id)
+        turn = self._tails[vehicle_id] = asyncio.get_running_loop().create_future()
+        try:
+            ctx = await self.pipeline.execute(PipelineContext(raw), last_stage=_CONCURRENT_UNTIL)
+            if ctx.dropped is None:
+                if previous is not None and not previous.done():
+                    metrics.incr("ordering.waits")
+                    # Jaga urutan kedatangan walau enrich sampel sebelumnya lebih lambat
+                    await asyncio.shield(previous)
+                await self.pipeline.execute(ctx, first_stage=_ORDERED_FROM)
+            return ctx
+        finally:
+            if previous is None or previous.done():
+                self._release(vehicle_id, turn)
+            else:
+                # Selesai sebelum giliran: sampel berikutnya tetap harus menunggu sampel sebelumnya
+                previous.add_done_callback(lambda _: self._release(vehicle_id, turn))
+
+    def _release(self, vehicle_id: str, turn: asyncio.Future) -> None:
+        turn.set_result(None)
+        if self._tails.get(vehicle_id) is turn:
+            del self._tails[vehicle_id]
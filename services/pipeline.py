@@ -0,0 +1,286 @@
+import asyncio
+import inspect
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.dialects.postgresql import insert
+
+from models import TelemetryIn
+from services.ai_service import analyze_damage
+from services.metrics import Metrics, metrics as default_metrics
+
+STAGES = ("validate", "rules", "dedup", "enrich", "persist", "publish", "analytics")
+
+
+def compute_status(
+    rpm: int,
+    temp: int,
+    dtc_code: str | None,
+    tps_percent: float | None,
+    batt_volt: float | None,
+    fuel_trim_short: float | None,
+) -> list[str]:
+    statuses: list[str] = []
+    critical = False
+
+    if temp > 100:
+        statuses.append("OVERHEAT")
+        critical = True
+    if rpm > 6000:
+        statuses.append("OVERSPEED")
+
+    if dtc_code:
+        critical = True
+
+    if batt_volt is not None and batt_volt < 11.5:
+        statuses.append("LOW_BATTERY")
+
+    if rpm < 1000 and tps_percent is not None and tps_percent > 5.0:
+        statuses.append("IDLE_TPS_ERROR")
+
+    if fuel_trim_short is not None and (fuel_trim_short > 15.0 or fuel_trim_short < -15.0):
+        statuses.append("AFR_ISSUE")
+
+    if critical:
+        statuses.append("CRITICAL")
+    if not statuses:
+        return ["NORMAL"]
+    return statuses
+
+
+class PipelineContext:
+    """State satu sampel telemetry sepanjang pipeline."""
+
+    def __init__(self, raw: Union[TelemetryIn, Dict[str, Any]]):
+        self.raw = raw
+        self.payload: Optional[TelemetryIn] = raw if isinstance(raw, TelemetryIn) else None
+        self.statuses: list[str] = []
+        self.record: Dict[str, Any] = {}
+        self.ai_advice: Optional[Dict[str, Any]] = None
+        self.encoded: Optional[Dict[str, Any]] = None
+        # Alasan sampel dihentikan di tengah pipeline (stage berikutnya dilewati)
+        self.dropped: Optional[str] = None
+        # Sampel lebih lama dari state terakhir: simpan ke riwayat saja
+        self.stale = False
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        # Dipanggil (urutan terbalik) jika salah satu stage melempar exception
+        self.rollbacks: list[Callable[[], None]] = []
+
+    def drop(self, reason: str) -> None:
+        self.dropped = reason
+
+    def on_failure(self, callback: Callable[[], None]) -> None:
+        self.rollbacks.append(callback)
+
+
+Stage = Callable[[PipelineContext], Union[None, Awaitable[None]]]
+
+
+def validate_stage(ctx: PipelineContext) -> None:
+    if ctx.payload is None:
+        ctx.payload = TelemetryIn(**ctx.raw)
+
+
+def rules_stage(ctx: PipelineContext) -> None:
+    payload = ctx.payload
+    ctx.statuses = compute_status(
+        payload.rpm,
+        payload.temp,
+        payload.dtc_code,
+        payload.tps_percent,
+        payload.batt_volt,
+        payload.fuel_trim_short
+    )
+    record = payload.dict(exclude_none=True)
+    record["timestamp"] = payload.timestamp.isoformat()
+    record["status"] = ctx.statuses
+    ctx.record = record
+
+
+def needs_ai(ctx: PipelineContext) -> bool:
+    return ("CRITICAL" in ctx.statuses) or bool(ctx.payload.dtc_code)
+
+
+def normalize_ai_advice(ai_result: Any) -> Optional[Dict[str, Any]]:
+    if not ai_result:
+        return None
+    if isinstance(ai_result, str):
+        try:
+            return json.loads(ai_result)
+        except Exception:
+            return {"raw": ai_result}
+    return ai_result
+
+
+async def enrich_stage(ctx: PipelineContext) -> None:
+    if needs_ai(ctx):
+        payload = ctx.payload
+        # analyze_damage memanggil API AI secara blocking; jalankan di thread agar event loop tetap bebas
+        ctx.ai_advice = normalize_ai_advice(await asyncio.to_thread(
+            analyze_damage,
+            payload.dtc_code,
+            payload.temp,
+            payload.vehicle_model,
+            payload.tps_percent,
+            payload.batt_volt,
+            payload.o2_volt,
+            payload.map_kpa
+        ))
+    ctx.record["ai_advice"] = ctx.ai_advice
+
+
+class DatabaseSink:
+    """Stage persist: upsert state terakhir, append ke riwayat, dan akumulasi rollup."""
+
+    def __init__(self, database, rollups=None):
+        # Import lambat agar pipeline bisa dipakai tanpa konfigurasi database
+        from database import INSERT_SAMPLE_QUERY, UPSERT_LATEST_QUERY, TelemetryRecord, TelemetrySample
+        from services.rollups import rollup_accumulator
+
+        self.database = database
+        self.latest_table = TelemetryRecord.__table__
+        self.samples_table = TelemetrySample.__table__
+        self.rollups = rollups if rollups is not None else rollup_accumulator
+        self.upsert_latest_query = UPSERT_LATEST_QUERY
+        self.insert_sample_query = INSERT_SAMPLE_QUERY
+
+    def latest_row(self, ctx: PipelineContext) -> Dict[str, Any]:
+        payload = ctx.payload
+        return {
+            "vehicle_id": payload.vehicle_id,
+            "timestamp": payload.timestamp.replace(tzinfo=None),
+            "rpm": payload.rpm,
+            "temp": payload.temp,
+            "dtc_code": payload.dtc_code,
+            "tps_percent": payload.tps_percent,
+            "batt_volt": payload.batt_volt,
+            "fuel_trim_short": payload.fuel_trim_short,
+            "o2_volt": payload.o2_volt,
+            "map_kpa": payload.map_kpa,
+            "vehicle_model": payload.vehicle_model,
+            "status": ctx.statuses,
+            "ai_advice": ctx.ai_advice,
+        }
+
+    def sample_row(self, ctx: PipelineContext) -> Dict[str, Any]:
+        row = self.latest_row(ctx)
+        row["speed"] = ctx.payload.speed
+        return row
+
+    def upsert_latest(self, rows: list[Dict[str, Any]]):
+        stmt = insert(self.latest_table).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["vehicle_id"],
+            set_={k: stmt.excluded[k] for k in rows[0] if k != "vehicle_id"},
+            where=self.latest_table.c.timestamp <= stmt.excluded.timestamp,
+        )
+
+    async def __call__(self, ctx: PipelineContext) -> None:
+        row = self.latest_row(ctx)
+        if not ctx.stale:
+            await self.upsert_latest_query.execute(self.database, **row)
+        await self.insert_sample_query.execute(self.database, **self.sample_row(ctx))
+        self.rollups.add(row["vehicle_id"], row["timestamp"], row["rpm"], row["temp"], row["batt_volt"], ctx.statuses)
+
+
+class Publisher:
+    """Stage publish: perbarui store in-memory (dan tabel shared-memory) lalu broadcast ke hub realtime."""
+
+    def __init__(self, store: Dict[str, Dict[str, Any]], hub=None, shared=None):
+        self.store = store
+        self.hub = hub
+        self.shared = shared
+
+    async def __call__(self, ctx: PipelineContext) -> None:
+        if ctx.stale:
+            return
+        self.store[ctx.payload.vehicle_id] = ctx.record
+        if self.shared is not None:
+            self.shared.put(ctx.payload.vehicle_id, ctx.encoded)
+        if self.hub is not None:
+            await self.hub.publish(ctx.payload.vehicle_id, ctx.encoded)
+
+
+class TelemetryPipeline:
+    """Alur ingest validate -> rules -> dedup -> enrich -> persist -> publish -> analytics.
+
+    Setiap stage adalah callable ``stage(ctx)`` (sync atau async) yang bisa
+    diganti lewat argumen konstruktor atau ``replace``. Stage yang None
+    dilewati, sehingga pipeline bisa dijalankan in-process tanpa HTTP/DB,
+    misalnya untuk replay traffic rekaman. Durasi setiap stage dicatat ke
+    ``metrics`` dengan nama ``pipeline.<stage>``.
+    """
+
+    def __init__(
+        self,
+        validate: Optional[Stage] = validate_stage,
+        rules: Optional[Stage] = rules_stage,
+        dedup: Optional[Stage] = None,
+        enrich: Optional[Stage] = enrich_stage,
+        persist: Optional[Stage] = None,
+        publish: Optional[Stage] = None,
+        analytics: Optional[Stage] = None,
+        metrics: Metrics = default_metrics,
+    ):
+        self.stages: Dict[str, Optional[Stage]] = {
+            "validate": validate,
+            "rules": rules,
+            "dedup": dedup,
+            "enrich": enrich,
+            "persist": persist,
+            "publish": publish,
+            "analytics": analytics,
+        }
+        self.metrics = metrics
+
+    def replace(self, name: str, stage: Optional[Stage]) -> None:
+        if name not in STAGES:
+            raise ValueError(f"Stage tidak dikenal: {name}")
+        self.stages[name] = stage
+
+    async def _run_stage(self, name: str, stage: Stage, ctx: PipelineContext) -> None:
+        start = time.perf_counter()
+        try:
+            result = stage(ctx)
+            if inspect.isawaitable(result):
+                await result
+        finally:
+            elapsed = time.perf_counter() - start
+            ctx.timings[name] = elapsed
+            self.metrics.observe(f"pipeline.{name}", elapsed)
+
+    async def run(self, raw: Union[TelemetryIn, Dict[str, Any]]) -> PipelineContext:
+        return await self.execute(PipelineContext(raw))
+
+    async def execute(self, ctx: PipelineContext, first_stage: str = "validate",
+                      last_stage: str = STAGES[-1]) -> PipelineContext:
+        """Menjalankan stage ``first_stage`` sampai ``last_stage``.
+
+        Stage sebelum ``first_stage`` dianggap sudah dijalankan; sisanya bisa
+        dilanjutkan dengan ``execute`` berikutnya pada ``ctx`` yang sama.
+        """
+        names = STAGES[STAGES.index(first_stage):STAGES.index(last_stage) + 1]
+        for name in names:
+            stage = self.stages[name]
+            if stage is not None:
+                try:
+                    await self._run_stage(name, stage, ctx)
+                except BaseException:
+                    # Batalkan efek stage sebelumnya (mis. timestamp di window dedup) agar retry diterima
+                    for callback in reversed(ctx.rollbacks):
+                        callback()
+                    raise
+            if name == "enrich" and ctx.dropped is None:
+                ctx.encoded = jsonable_encoder(ctx.record)
+            if ctx.dropped is not None:
+                self.metrics.incr(f"pipeline.dropped.{ctx.dropped}")
+                if ctx.encoded is None:
+                    # Tetap beri respons (tanpa ai_advice) agar device menganggap paket terkirim
+                    ctx.encoded = jsonable_encoder(ctx.record)
+                break
+        if ctx.dropped is not None or last_stage == STAGES[-1]:
+            self.metrics.observe("pipeline.total", time.perf_counter() - ctx.started)
+        return ctx
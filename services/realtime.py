@@ -0,0 +1,393 @@
+import asyncio
+import json
+import os
+import secrets
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import WebSocket
+
+# Setiap berapa pesan delta dikirim ulang snapshot penuh (keyframe) per kendaraan
+WS_KEYFRAME_INTERVAL = int(os.getenv("WS_KEYFRAME_INTERVAL", "50"))
+
+# Subprotocol WebSocket untuk negosiasi mode delta (alternatif dari ?mode=delta)
+DELTA_SUBPROTOCOL = "otosense.delta.v1"
+
+# Jumlah event terakhir yang disimpan untuk replay (resume_from / Last-Event-ID)
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "10000"))
+
+# Kapasitas antrian per klien SSE sebelum koneksinya diputus (klien lalu resume)
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "1000"))
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class Event:
+    """Satu broadcast telemetry dengan nomor urut global dan epoch proses penerbitnya."""
+
+    __slots__ = ("seq", "epoch", "vehicle_id", "record", "text", "_tagged")
+
+    def __init__(self, seq: int, vehicle_id: str, record: Dict[str, Any], epoch: str = ""):
+        self.seq = seq
+        self.epoch = epoch
+        self.vehicle_id = vehicle_id
+        self.record = record
+        self.text = _dumps(record)
+        self._tagged: Optional[str] = None
+
+    @property
+    def token(self) -> str:
+        """Posisi resume ``<epoch>:<seq>`` (nilai ``resume_from`` / ``Last-Event-ID``)."""
+        return f"{self.epoch}:{self.seq}"
+
+    @property
+    def tagged_text(self) -> str:
+        """Record JSON dengan field ``seq`` dan ``epoch`` ditambahkan (mode default WebSocket)."""
+        if self._tagged is None:
+            tags = f'"seq":{self.seq},"epoch":{_dumps(self.epoch)}'
+            self._tagged = f"{self.text[:-1]},{tags}}}" if self.text != "{}" else f"{{{tags}}}"
+        return self._tagged
+
+
+def negotiate_delta(websocket: WebSocket) -> tuple[bool, Optional[str]]:
+    """Menentukan apakah klien meminta protokol delta.
+
+    Mengembalikan (delta, subprotocol) di mana subprotocol diteruskan ke
+    ``websocket.accept`` jika klien menegosiasikannya lewat header.
+    """
+    if DELTA_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return True, DELTA_SUBPROTOCOL
+    return websocket.query_params.get("mode") == "delta", None
+
+
+def parse_resume_from(value: Optional[str]) -> Optional[tuple[Optional[str], int]]:
+    """``"<epoch>:<seq>"`` -> (epoch, seq). Angka saja (tanpa epoch) -> (None, seq), selalu dijawab snapshot."""
+    if value is None or value == "":
+        return None
+    epoch, _, seq = value.rpartition(":")
+    try:
+        return epoch or None, max(int(seq), 0)
+    except ValueError:
+        return None
+
+
+class Subscriber:
+    """Satu koneksi WebSocket dashboard beserta state protokol delta-nya.
+
+    Setiap pesan membawa nomor urut global dan ``epoch`` hub untuk resume
+    berikutnya. Jika ``feed`` aktif (klien membuka koneksi dengan
+    ``resume_from``), record penuh dibungkus ``{"type": "event", "seq",
+    "epoch", "vehicle_id", "data"}``; tanpa itu field ``seq`` dan ``epoch``
+    ditambahkan ke record.
+    """
+
+    def __init__(self, websocket: Optional[WebSocket], delta: bool = False, feed: bool = False):
+        self.websocket = websocket
+        self.delta = delta
+        self.feed = feed
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._seq: Dict[str, int] = {}
+        self._since_keyframe: Dict[str, int] = {}
+
+        # Filter langganan; None berarti tidak difilter
+        self.vehicle_ids: Optional[set[str]] = None
+        self.vehicle_models: Optional[set[str]] = None
+        self.statuses: Optional[set[str]] = None
+        self.min_interval: float = 0.0
+
+        self.closed = False
+        self._last_sent_at: Dict[str, float] = {}
+        self._pending: Dict[str, Event] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._held: Optional[list[Event]] = None
+
+    def subscribe(self, vehicle_ids: Optional[list[str]] = None, vehicle_models: Optional[list[str]] = None,
+                  statuses: Optional[list[str]] = None, max_rate: Optional[float] = None) -> None:
+        """Mengganti filter langganan. ``max_rate`` = maksimum update per detik per kendaraan."""
+        self.vehicle_ids = set(vehicle_ids) if vehicle_ids else None
+        self.vehicle_models = set(vehicle_models) if vehicle_models else None
+        self.statuses = {s.upper() for s in statuses} if statuses else None
+        self.min_interval = 1.0 / max_rate if max_rate and max_rate > 0 else 0.0
+
+    def matches(self, vehicle_id: str, record: Dict[str, Any]) -> bool:
+        if self.vehicle_ids is not None and vehicle_id not in self.vehicle_ids:
+            return False
+        if self.vehicle_models is not None and record.get("vehicle_model") not in self.vehicle_models:
+            return False
+        if self.statuses is not None and not self.statuses.intersection(record.get("status") or []):
+            return False
+        return True
+
+    def request_keyframe(self, vehicle_id: Optional[str] = None) -> None:
+        """Memaksa pesan berikutnya (per kendaraan atau semua) berupa snapshot."""
+        if vehicle_id is None:
+            self._last.clear()
+        else:
+            self._last.pop(vehicle_id, None)
+
+    def build_message(self, vehicle_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        seq = self._seq.get(vehicle_id, 0) + 1
+        self._seq[vehicle_id] = seq
+        last = self._last.get(vehicle_id)
+        since = self._since_keyframe.get(vehicle_id, 0)
+        self._last[vehicle_id] = record
+
+        if last is None or since >= WS_KEYFRAME_INTERVAL:
+            self._since_keyframe[vehicle_id] = 0
+            return {"type": "snapshot", "vehicle_id": vehicle_id, "seq": seq, "data": record}
+
+        self._since_keyframe[vehicle_id] = since + 1
+        message: Dict[str, Any] = {
+            "type": "delta",
+            "vehicle_id": vehicle_id,
+            "seq": seq,
+            "changed": {k: v for k, v in record.items() if k not in last or last[k] != v},
+        }
+        removed = [k for k in last if k not in record]
+        if removed:
+            message["removed"] = removed
+        return message
+
+    async def send(self, event: Event) -> None:
+        if self.delta:
+            message = self.build_message(event.vehicle_id, event.record)
+            message["event_seq"] = event.seq
+            message["epoch"] = event.epoch
+            await self.websocket.send_json(message)
+        elif self.feed:
+            await self.websocket.send_text(
+                f'{{"type":"event","seq":{event.seq},"epoch":{_dumps(event.epoch)},'
+                f'"vehicle_id":{_dumps(event.vehicle_id)},"data":{event.text}}}'
+            )
+        else:
+            await self.websocket.send_text(event.tagged_text)
+
+    async def send_snapshot(self, event: Event) -> None:
+        """Mengirim state terkini sebuah kendaraan (saat connect atau fallback resume)."""
+        if self.feed and not self.delta:
+            await self.websocket.send_json({
+                "type": "snapshot", "seq": event.seq, "epoch": event.epoch,
+                "vehicle_id": event.vehicle_id, "data": event.record,
+            })
+        else:
+            await self.send(event)
+
+    async def offer(self, event: Event) -> None:
+        """Mengirim event jika lolos filter, dengan konflasi ke state terakhir per kendaraan.
+
+        Jika ``max_rate`` aktif dan interval belum lewat, event disimpan sebagai
+        pending (menimpa pending sebelumnya) dan dikirim saat interval berakhir.
+        """
+        vehicle_id = event.vehicle_id
+        if not self.matches(vehicle_id, event.record):
+            return
+        if self._held is not None:
+            self._held.append(event)
+            return
+        if not self.min_interval:
+            await self.send(event)
+            return
+
+        loop = asyncio.get_running_loop()
+        wait = self._last_sent_at.get(vehicle_id, float("-inf")) + self.min_interval - loop.time()
+        if wait <= 0 and vehicle_id not in self._timers:
+            self._last_sent_at[vehicle_id] = loop.time()
+            await self.send(event)
+            return
+
+        self._pending[vehicle_id] = event
+        if vehicle_id not in self._timers:
+            self._timers[vehicle_id] = loop.call_later(
+                max(wait, 0.0), lambda: asyncio.ensure_future(self._flush(vehicle_id))
+            )
+
+    async def _flush(self, vehicle_id: str) -> None:
+        self._timers.pop(vehicle_id, None)
+        event = self._pending.pop(vehicle_id, None)
+        if event is None or self.closed:
+            return
+        self._last_sent_at[vehicle_id] = asyncio.get_running_loop().time()
+        try:
+            await self.send(event)
+        except Exception:
+            self.close()
+
+    def hold(self) -> None:
+        """Menahan event live selama state awal (snapshot/replay) sedang dikirim."""
+        self._held = []
+
+    async def release(self) -> None:
+        held, self._held = self._held or [], None
+        for event in held:
+            await self.offer(event)
+
+    def close(self) -> None:
+        self.closed = True
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+
+    def handle_message(self, text: str) -> None:
+        """Memproses pesan kontrol dari klien.
+
+        - ``{"type": "resync", "vehicle_id": ...}``: minta snapshot (mode delta)
+        - ``{"type": "subscribe", "vehicle_ids": [...], "vehicle_models": [...],
+          "statuses": [...], "max_rate": 1.0}``: ganti filter langganan
+        """
+        try:
+            msg = json.loads(text)
+        except Exception:
+            return
+        if not isinstance(msg, dict):
+            return
+        if msg.get("type") == "resync":
+            self.request_keyframe(msg.get("vehicle_id"))
+        elif msg.get("type") == "subscribe":
+            try:
+                max_rate = float(msg["max_rate"]) if msg.get("max_rate") is not None else None
+            except (TypeError, ValueError):
+                max_rate = None
+            self.subscribe(
+                vehicle_ids=msg.get("vehicle_ids"),
+                vehicle_models=msg.get("vehicle_models"),
+                statuses=msg.get("statuses"),
+                max_rate=max_rate,
+            )
+
+
+class SSESubscriber(Subscriber):
+    """Subscriber untuk endpoint Server-Sent Events; event ditampung di antrian."""
+
+    def __init__(self):
+        super().__init__(None, feed=True)
+        self.queue: asyncio.Queue[tuple[str, Optional[Event]]] = asyncio.Queue()
+
+    async def offer(self, event: Event) -> None:
+        if self._held is None and self.queue.qsize() >= SSE_QUEUE_SIZE:
+            # Klien terlalu lambat: putus, klien akan reconnect dengan Last-Event-ID
+            self.close()
+            raise ConnectionError("SSE client too slow")
+        await super().offer(event)
+
+    async def send(self, event: Event) -> None:
+        self.queue.put_nowait(("telemetry", event))
+
+    async def send_snapshot(self, event: Event) -> None:
+        self.queue.put_nowait(("snapshot", event))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        self.queue.put_nowait(("close", None))
+
+    @staticmethod
+    def format(kind: str, event: Event) -> str:
+        return f"id: {event.token}\nevent: {kind}\ndata: {event.text}\n\n"
+
+
+class Hub:
+    """Registry subscriber WebSocket per kendaraan dan global, plus ring buffer event.
+
+    ``seq`` hanya bermakna di dalam satu proses: setiap hub punya ``epoch``
+    acak, sehingga posisi resume dari proses lain (restart atau worker
+    uvicorn lain) dikenali dan dijawab dengan snapshot, bukan replay.
+    """
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self.by_vehicle: Dict[str, list[Subscriber]] = {}
+        self.global_subscribers: list[Subscriber] = []
+        self.epoch = secrets.token_hex(6)
+        self.seq = 0
+        self.events: deque[Event] = deque(maxlen=buffer_size)
+
+    def add(self, subscriber: Subscriber, vehicle_id: Optional[str] = None) -> None:
+        if vehicle_id is None:
+            self.global_subscribers.append(subscriber)
+        else:
+            self.by_vehicle.setdefault(vehicle_id, []).append(subscriber)
+
+    def remove(self, subscriber: Subscriber, vehicle_id: Optional[str] = None) -> None:
+        subscriber.close()
+        subscribers = self.global_subscribers if vehicle_id is None else self.by_vehicle.get(vehicle_id, [])
+        if subscriber in subscribers:
+            subscribers.remove(subscriber)
+
+    def replay(self, after: tuple[Optional[str], int], vehicle_id: Optional[str] = None) -> Optional[list[Event]]:
+        """Event dengan seq > ``after`` (``(epoch, seq)``) dari buffer.
+
+        Mengembalikan None jika ``after`` berasal dari epoch lain (proses
+        sebelum restart, worker lain, atau tanpa epoch) atau celahnya sudah
+        tidak tercakup buffer; pemanggil harus mengirim snapshot sebagai gantinya.
+        """
+        epoch, after_seq = after
+        if epoch != self.epoch or after_seq > self.seq:
+            return None
+        oldest = self.events[0].seq if self.events else self.seq + 1
+        if after_seq + 1 < oldest and after_seq < self.seq:
+            return None
+        return [
+            e for e in self.events
+            if e.seq > after_seq and (vehicle_id is None or e.vehicle_id == vehicle_id)
+        ]
+
+    async def attach(self, subscriber: Subscriber, load_state: Callable[[Optional[str]], Dict[str, Dict[str, Any]]],
+                     vehicle_id: Optional[str] = None, resume_from: Optional[tuple[Optional[str], int]] = None,
+                     snapshot: bool = True) -> None:
+        """Mendaftarkan subscriber lalu mengirim state awalnya.
+
+        Dengan ``resume_from``, event yang terlewat di-replay dari buffer; jika
+        celahnya terlalu besar, dikirim snapshot state terkini dari
+        ``load_state(vehicle_id)`` (dict vehicle_id -> record ter-encode).
+        Event live yang masuk selama itu ditahan lalu dikirim setelahnya,
+        sehingga urutan seq tetap naik tanpa celah.
+        """
+        subscriber.hold()
+        self.add(subscriber, vehicle_id)
+        try:
+            events = self.replay(resume_from, vehicle_id) if resume_from is not None else None
+            if events is not None:
+                for event in events:
+                    if subscriber.matches(event.vehicle_id, event.record):
+                        await subscriber.send(event)
+            elif resume_from is not None or snapshot:
+                seq = self.seq
+                for vid, record in load_state(vehicle_id).items():
+                    if subscriber.matches(vid, record):
+                        await subscriber.send_snapshot(Event(seq, vid, record, self.epoch))
+        finally:
+            await subscriber.release()
+
+    async def _fanout(self, subscribers: list[Subscriber], event: Event) -> None:
+        dead = []
+        for sub in subscribers:
+            if sub.closed:
+                dead.append(sub)
+                continue
+            try:
+                await sub.offer(event)
+            except Exception:
+                dead.append(sub)
+        for sub in dead:
+            sub.close()
+            if sub in subscribers:
+                subscribers.remove(sub)
+
+    async def publish(self, vehicle_id: str, record: Dict[str, Any]) -> Event:
+        """Memberi nomor urut, menyimpan ke buffer, lalu mengirim ke semua subscriber terkait.
+
+        ``record`` harus sudah di-``jsonable_encoder``.
+        """
+        self.seq += 1
+        event = Event(self.seq, vehicle_id, record, self.epoch)
+        self.events.append(event)
+        if vehicle_id in self.by_vehicle:
+            await self._fanout(self.by_vehicle[vehicle_id], event)
+        await self._fanout(self.global_subscribers, event)
+        return event
+
+
+hub = Hub()
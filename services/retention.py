@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+from services.metrics import metrics
+from services.rollups import STATUS_COLUMNS
+
+# Umur maksimal sampel mentah (hari); partisi yang seluruhnya lebih tua dihapus setelah di-downsample
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", "30"))
+# Umur maksimal rollup per menit (hari); 0 = simpan selamanya. Rollup per jam selalu disimpan
+RETENTION_MINUTE_ROLLUP_DAYS = int(os.getenv("RETENTION_MINUTE_ROLLUP_DAYS", "90"))
+# Granularitas partisi telemetry_samples: "day" atau "week"
+RETENTION_PARTITION = os.getenv("RETENTION_PARTITION", "day")
+# Jumlah partisi yang disiapkan di depan periode berjalan
+RETENTION_PRECREATE = int(os.getenv("RETENTION_PRECREATE", "7"))
+# Interval job retensi di server (detik); 0 = nonaktif
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+
+PARENT_TABLE = "telemetry_samples"
+PARTITIONS = ("day", "week")
+
+# Kunci pg_advisory_lock agar hanya satu worker/proses yang menjalankan retensi
+_LOCK_KEY = 0x0705E75E
+
+_PARTITIONS_QUERY = """
+SELECT c.relname AS name,
+       pg_get_expr(c.relpartbound, c.oid) AS bound,
+       pg_total_relation_size(c.oid) AS bytes,
+       c.reltuples::bigint AS rows_estimate
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'telemetry_samples'::regclass
+ORDER BY c.relname
+"""
+
+_IS_PARTITIONED_QUERY = """
+SELECT count(*) FROM pg_partitioned_table p
+JOIN pg_class c ON c.oid = p.partrelid
+WHERE c.relname = 'telemetry_samples'
+"""
+
+# Query di transaksi job ini bisa memindai satu partisi utuh; abaikan statement_timeout pool
+_NO_TIMEOUT = "SET LOCAL statement_timeout = 0"
+# Maksimal periode yang dipindahkan dari partisi default per putaran
+_MAX_DRAIN_PERIODS = 31
+
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _parse_bound_value(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def parse_partition(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Baris pg_class -> partisi dengan rentang ``[start, end)`` (None = tak terbatas)."""
+    bound = row["bound"] or ""
+    partition = {
+        "name": row["name"],
+        "start": None,
+        "end": None,
+        "default": bound == "DEFAULT",
+        "bytes": int(row["bytes"] or 0),
+        "rows_estimate": max(int(row["rows_estimate"] or 0), 0),
+    }
+    match = _BOUND_RE.search(bound)
+    if match:
+        partition["start"] = _parse_bound_value(match.group(1))
+        partition["end"] = _parse_bound_value(match.group(2))
+    return partition
+
+
+def period_start(ts: datetime, granularity: str) -> datetime:
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_length(granularity: str) -> timedelta:
+    return timedelta(days=7 if granularity == "week" else 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_p{start:%Y%m%d}"
+
+
+def _overlaps(partition: Dict[str, Any], start: datetime, end: datetime) -> bool:
+    if partition["default"]:
+        return False
+    lo, hi = partition["start"], partition["end"]
+    return (lo is None or lo < end) and (hi is None or hi > start)
+
+
+def plan_retention(partitions: List[Dict[str, Any]], now: datetime, raw_days: int = RETENTION_RAW_DAYS,
+                   granularity: str = RETENTION_PARTITION, precreate: int = RETENTION_PRECREATE,
+                   default_days: Optional[List[datetime]] = None) -> Dict[str, Any]:
+    """Menentukan partisi yang perlu dibuat dan yang sudah kedaluwarsa (tanpa menyentuh database).
+
+    ``default_days`` adalah hari-hari yang barisnya ada di partisi default.
+    Periode tersebut ikut dibuat dengan ``from_default=True``: barisnya harus
+    dipindahkan dulu, karena ``CREATE TABLE ... PARTITION OF`` ditolak selama
+    partisi default masih berisi baris untuk rentang itu.
+    """
+    step = period_length(granularity)
+    periods = []
+    start = period_start(now, granularity)
+    for _ in range(precreate + 1):
+        periods.append(start)
+        start += step
+    drain = sorted({period_start(d, granularity) for d in default_days or []})
+    for start in drain:
+        if start not in periods:
+            periods.append(start)
+
+    create = []
+    for start in sorted(periods):
+        end = start + step
+        if not any(_overlaps(p, start, end) for p in partitions):
+            create.append({"name": partition_name(start), "start": start, "end": end, "from_default": start in drain})
+
+    cutoff = now - timedelta(days=raw_days)
+    drop = [p for p in partitions if not p["default"] and p["end"] is not None and p["end"] <= cutoff]
+    return {"cutoff": cutoff, "create": create, "drop": drop}
+
+
+def _rebuild_hour_rollups_sql(partition: str) -> str:
+    """INSERT..SELECT set-based: rollup per jam dihitung ulang dari satu partisi utuh (idempoten)."""
+    status_columns = list(STATUS_COLUMNS.items())
+    columns = [
+        "vehicle_id", "bucket", "bucket_start", "sample_count",
+        "temp_min", "temp_max", "temp_sum", "rpm_min", "rpm_max", "rpm_sum",
+        "batt_volt_min", "batt_volt_max", "batt_volt_sum", "batt_volt_count",
+    ] + [column for _, column in status_columns]
+    select = [
+        "vehicle_id", "'hour'", "date_trunc('hour', timestamp)", "count(*)",
+        "min(temp)", "max(temp)", "sum(temp)", "min(rpm)", "max(rpm)", "sum(rpm)",
+        "min(batt_volt)", "max(batt_volt)", "coalesce(sum(batt_volt), 0)", "count(batt_volt)",
+    ] + [f"count(*) FILTER (WHERE status::jsonb ? '{status}')" for status, _ in status_columns]
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns[3:])
+    return (
+        f"INSERT INTO telemetry_rollups ({', '.join(columns)}) "
+        f"SELECT {', '.join(select)} FROM \"{partition}\" GROUP BY vehicle_id, date_trunc('hour', timestamp) "
+        f"ON CONFLICT (vehicle_id, bucket, bucket_start) DO UPDATE SET {updates}"
+    )
+
+
+def _bound(ts: datetime) -> str:
+    return f"'{ts:%Y-%m-%d %H:%M:%S}'"
+
+
+async def _create_partition(connection, p: Dict[str, Any], default: Optional[str]) -> int:
+    """Membuat partisi; jika ``from_default``, baris rentangnya dipindahkan dari partisi default.
+
+    Tabel dibuat terpisah, diisi dengan baris yang dihapus dari partisi
+    default, lalu di-ATTACH, semuanya dalam satu transaksi. Mengembalikan
+    jumlah baris yang dipindahkan.
+    """
+    bounds = f"FROM ({_bound(p['start'])}) TO ({_bound(p['end'])})"
+    if not p.get("from_default") or default is None:
+        await connection.execute(f"CREATE TABLE IF NOT EXISTS \"{p['name']}\" PARTITION OF {PARENT_TABLE} FOR VALUES {bounds}")
+        return 0
+    async with connection.transaction():
+        await connection.execute(_NO_TIMEOUT)
+        await connection.execute(
+            f"CREATE TABLE \"{p['name']}\" (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        moved = await connection.fetch_val(
+            f"WITH moved AS (DELETE FROM \"{default}\" WHERE timestamp >= :start AND timestamp < :end RETURNING *), "
+            f"inserted AS (INSERT INTO \"{p['name']}\" SELECT * FROM moved RETURNING 1) "
+            f"SELECT count(*) FROM inserted",
+            {"start": p["start"], "end": p["end"]},
+        )
+        await connection.execute(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION \"{p['name']}\" FOR VALUES {bounds}")
+    return moved or 0
+
+
+async def list_partitions(connection) -> List[Dict[str, Any]]:
+    rows = await connection.fetch_all(_PARTITIONS_QUERY)
+    return [parse_partition(dict(r._mapping) if hasattr(r, "_mapping") else dict(r)) for r in rows]
+
+
+async def run_retention(database, dry_run: bool = False, now: Optional[datetime] = None,
+                        raw_days: int = RETENTION_RAW_DAYS, minute_rollup_days: int = RETENTION_MINUTE_ROLLUP_DAYS,
+                        granularity: str = RETENTION_PARTITION, precreate: int = RETENTION_PRECREATE) -> Dict[str, Any]:
+    """Satu putaran retensi: siapkan partisi, downsample + drop partisi kedaluwarsa, padatkan rollup menit.
+
+    Partisi kedaluwarsa dihapus dengan satu ``DROP TABLE`` (bukan DELETE per
+    baris) dalam transaksi yang sama dengan pembangunan ulang rollup per jam
+    dari partisi tersebut. Baris yang tertampung di partisi default dipindahkan
+    ke partisi periodenya; sisa baris di partisi default dilaporkan sebagai
+    error. Query berat dijalankan tanpa ``statement_timeout`` (``SET LOCAL``).
+    Dengan ``dry_run=True`` hanya rencana dan estimasi ruang yang dilaporkan.
+    """
+    if granularity not in PARTITIONS:
+        raise ValueError(f"RETENTION_PARTITION harus salah satu dari {list(PARTITIONS)}")
+    now = now or datetime.utcnow()
+    report: Dict[str, Any] = {"dry_run": dry_run, "now": now.isoformat()}
+    if database.url.dialect != "postgresql":
+        report["skipped"] = "retensi partisi membutuhkan PostgreSQL"
+        return report
+
+    start = time.perf_counter()
+    async with database.connection() as connection:
+        if not await connection.fetch_val(_IS_PARTITIONED_QUERY):
+            report["skipped"] = "telemetry_samples belum dipartisi (jalankan alembic upgrade head)"
+            return report
+        if not await connection.fetch_val("SELECT pg_try_advisory_lock(:key)", {"key": _LOCK_KEY}):
+            report["skipped"] = "retensi sedang dijalankan proses lain"
+            return report
+        try:
+            partitions = await list_partitions(connection)
+            default = next((p for p in partitions if p["default"]), None)
+            default_days: List[datetime] = []
+            if default is not None:
+                # Baris di partisi default menghalangi pembuatan partisi untuk rentangnya
+                default_days = [
+                    r["day"] for r in await connection.fetch_all(
+                        f"SELECT DISTINCT date_trunc('day', timestamp) AS day FROM \"{default['name']}\" "
+                        f"ORDER BY day LIMIT {_MAX_DRAIN_PERIODS}"
+                    )
+                ]
+            plan = plan_retention(partitions, now, raw_days, granularity, precreate, default_days)
+            report["cutoff"] = plan["cutoff"].isoformat()
+
+            report["created_partitions"] = [p["name"] for p in plan["create"]]
+            report["drained_from_default"] = {p["name"]: None for p in plan["create"] if p["from_default"]}
+            if not dry_run:
+                for p in plan["create"]:
+                    try:
+                        moved = await _create_partition(connection, p, default["name"] if default else None)
+                    except Exception as e:
+                        report.setdefault("errors", []).append(f"create {p['name']}: {e}")
+                        continue
+                    if p["from_default"]:
+                        report["drained_from_default"][p["name"]] = moved
+
+            dropped = []
+            for p in plan["drop"]:
+                entry = {
+                    "name": p["name"],
+                    "start": p["start"].isoformat() if p["start"] else None,
+                    "end": p["end"].isoformat(),
+                    "bytes": p["bytes"],
+                    "rows_estimate": p["rows_estimate"],
+                }
+                if not dry_run:
+                    try:
+                        async with connection.transaction():
+                            await connection.execute(_NO_TIMEOUT)
+                            await connection.execute(_rebuild_hour_rollups_sql(p["name"]))
+                            await connection.execute(f"DROP TABLE \"{p['name']}\"")
+                    except Exception as e:
+                        report.setdefault("errors", []).append(f"drop {p['name']}: {e}")
+                        continue
+                dropped.append(entry)
+            report["dropped_partitions"] = dropped
+            report["reclaimed_bytes"] = sum(p["bytes"] for p in dropped)
+
+            if minute_rollup_days > 0:
+                minute_cutoff = now - timedelta(days=minute_rollup_days)
+                values = {"cutoff": minute_cutoff}
+                where = "bucket = 'minute' AND bucket_start < :cutoff"
+                if dry_run:
+                    count = await connection.fetch_val(f"SELECT count(*) FROM telemetry_rollups WHERE {where}", values)
+                else:
+                    async with connection.transaction():
+                        await connection.execute(_NO_TIMEOUT)
+                        count = await connection.fetch_val(
+                            f"WITH deleted AS (DELETE FROM telemetry_rollups WHERE {where} RETURNING 1) "
+                            f"SELECT count(*) FROM deleted",
+                            values,
+                        )
+                report["minute_rollups_deleted"] = count or 0
+
+            if default is not None:
+                remaining = await connection.fetch_val(f"SELECT count(*) FROM \"{default['name']}\"")
+                report["default_partition_rows"] = remaining
+                if remaining and not dry_run:
+                    report.setdefault("errors", []).append(
+                        f"{default['name']} masih berisi {remaining} baris di luar partisi yang dikelola"
+                    )
+        finally:
+            await connection.fetch_val("SELECT pg_advisory_unlock(:key)", {"key": _LOCK_KEY})
+
+    if "default_partition_rows" in report:
+        metrics.set_gauge("retention.default_partition_rows", report["default_partition_rows"])
+    if not dry_run:
+        metrics.incr("retention.errors", len(report.get("errors", [])))
+        metrics.observe("retention.job", time.perf_counter() - start)
+        metrics.incr("retention.reclaimed_bytes", report["reclaimed_bytes"])
+        metrics.incr("retention.dropped_partitions", len(report["dropped_partitions"]))
+    return report
+
+
+async def run_retention_job(database, interval: float = RETENTION_INTERVAL_SECONDS) -> None:
+    """Background job: jalankan retensi saat startup lalu setiap ``interval`` detik sampai di-cancel."""
+    while True:
+        try:
+            report = await run_retention(database)
+            if "skipped" not in report and (report["created_partitions"] or report["dropped_partitions"]):
+                print(
+                    f"Retention: {len(report['created_partitions'])} partitions created, "
+                    f"{len(report['dropped_partitions'])} dropped, {report['reclaimed_bytes']} bytes reclaimed."
+                )
+            for error in report.get("errors", []):
+                print(f"Retention error: {error}")
+        except Exception as e:
+            metrics.incr("retention.errors")
+            print(f"Retention job failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="Retensi partisi telemetry_samples")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Siapkan partisi, downsample dan hapus partisi kedaluwarsa")
+    run.add_argument("--dry-run", action="store_true", help="Hanya tampilkan rencana dan ruang yang akan dibebaskan")
+    run.add_argument("--raw-days", type=int, default=RETENTION_RAW_DAYS)
+    run.add_argument("--minute-rollup-days", type=int, default=RETENTION_MINUTE_ROLLUP_DAYS)
+    args = parser.parse_args()
+
+    from database import database
+
+    await database.connect()
+    try:
+        if args.command == "run":
+            report = await run_retention(
+                database, dry_run=args.dry_run, raw_days=args.raw_days, minute_rollup_days=args.minute_rollup_days
+            )
+            print(json.dumps(report, indent=2, default=str))
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
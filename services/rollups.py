@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+from sqlalchemy import and_, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import select
+
+from database import TelemetryRollup, TelemetrySample
+
+# Interval flush akumulator rollup ke database (detik)
+ROLLUP_FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", "10"))
+
+# Jumlah baris per statement upsert / per chunk backfill
+ROLLUP_BATCH_SIZE = 500
+# Jumlah sampel per halaman baca backfill
+BACKFILL_PAGE_ROWS = 10000
+
+BUCKETS = ("minute", "hour")
+
+# Status dari _compute_status -> kolom counter di telemetry_rollups
+STATUS_COLUMNS = {
+    "NORMAL": "count_normal",
+    "OVERHEAT": "count_overheat",
+    "OVERSPEED": "count_overspeed",
+    "LOW_BATTERY": "count_low_battery",
+    "IDLE_TPS_ERROR": "count_idle_tps_error",
+    "AFR_ISSUE": "count_afr_issue",
+    "CRITICAL": "count_critical",
+}
+
+_METRICS = ("temp", "rpm", "batt_volt")
+
+
+def bucket_start(ts: datetime, bucket: str) -> datetime:
+    if bucket == "minute":
+        return ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+class _Accumulator:
+    __slots__ = (
+        "sample_count",
+        "temp_min", "temp_max", "temp_sum",
+        "rpm_min", "rpm_max", "rpm_sum",
+        "batt_volt_min", "batt_volt_max", "batt_volt_sum", "batt_volt_count",
+        "status_counts",
+    )
+
+    def __init__(self):
+        self.sample_count = 0
+        for m in _METRICS:
+            setattr(self, f"{m}_min", None)
+            setattr(self, f"{m}_max", None)
+            setattr(self, f"{m}_sum", 0.0)
+        self.batt_volt_count = 0
+        self.status_counts: Dict[str, int] = {}
+
+    def _observe(self, metric: str, value: float) -> None:
+        lo = getattr(self, f"{metric}_min")
+        hi = getattr(self, f"{metric}_max")
+        setattr(self, f"{metric}_min", value if lo is None or value < lo else lo)
+        setattr(self, f"{metric}_max", value if hi is None or value > hi else hi)
+        setattr(self, f"{metric}_sum", getattr(self, f"{metric}_sum") + value)
+
+    def add(self, rpm: float, temp: float, batt_volt: Optional[float], statuses: Iterable[str]) -> None:
+        self.sample_count += 1
+        self._observe("temp", temp)
+        self._observe("rpm", rpm)
+        if batt_volt is not None:
+            self._observe("batt_volt", batt_volt)
+            self.batt_volt_count += 1
+        for status in statuses:
+            if status in STATUS_COLUMNS:
+                self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def merge_row(self, row: Dict[str, Any]) -> None:
+        """Menggabungkan baris hasil ``to_row`` (mis. flush yang gagal) ke akumulator ini."""
+        self.sample_count += row["sample_count"]
+        self.batt_volt_count += row["batt_volt_count"]
+        for m in _METRICS:
+            for bound, pick in (("min", min), ("max", max)):
+                value, current = row[f"{m}_{bound}"], getattr(self, f"{m}_{bound}")
+                if value is not None:
+                    setattr(self, f"{m}_{bound}", value if current is None else pick(value, current))
+            setattr(self, f"{m}_sum", getattr(self, f"{m}_sum") + row[f"{m}_sum"])
+        for status, column in STATUS_COLUMNS.items():
+            if row[column]:
+                self.status_counts[status] = self.status_counts.get(status, 0) + row[column]
+
+    def to_row(self) -> Dict[str, Any]:
+        row: Dict[str, Any] = {"sample_count": self.sample_count, "batt_volt_count": self.batt_volt_count}
+        for m in _METRICS:
+            row[f"{m}_min"] = getattr(self, f"{m}_min")
+            row[f"{m}_max"] = getattr(self, f"{m}_max")
+            row[f"{m}_sum"] = getattr(self, f"{m}_sum")
+        for status, column in STATUS_COLUMNS.items():
+            row[column] = self.status_counts.get(status, 0)
+        return row
+
+
+class RollupAccumulator:
+    """Akumulator in-memory per (vehicle_id, bucket, bucket_start), dikosongkan saat flush."""
+
+    def __init__(self):
+        self._accs: Dict[tuple[str, str, datetime], _Accumulator] = {}
+
+    def __len__(self) -> int:
+        return len(self._accs)
+
+    def add(self, vehicle_id: str, timestamp: datetime, rpm: float, temp: float,
+            batt_volt: Optional[float], statuses: Iterable[str]) -> None:
+        statuses = list(statuses)
+        for bucket in BUCKETS:
+            key = (vehicle_id, bucket, bucket_start(timestamp, bucket))
+            acc = self._accs.get(key)
+            if acc is None:
+                acc = self._accs[key] = _Accumulator()
+            acc.add(rpm, temp, batt_volt, statuses)
+
+    def restore(self, rows: List[Dict[str, Any]]) -> None:
+        """Mengembalikan baris ``drain`` yang gagal di-upsert; sampel baru sejak drain ikut digabung."""
+        for row in rows:
+            key = (row["vehicle_id"], row["bucket"], row["bucket_start"])
+            acc = self._accs.get(key)
+            if acc is None:
+                acc = self._accs[key] = _Accumulator()
+            acc.merge_row(row)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        accs, self._accs = self._accs, {}
+        rows = []
+        for (vehicle_id, bucket, start), acc in accs.items():
+            row = acc.to_row()
+            row.update(vehicle_id=vehicle_id, bucket=bucket, bucket_start=start)
+            rows.append(row)
+        return rows
+
+
+rollup_accumulator = RollupAccumulator()
+
+
+def _upsert_statement(rows: List[Dict[str, Any]]):
+    table = TelemetryRollup.__table__
+    stmt = insert(table).values(rows)
+    excluded = stmt.excluded
+    set_ = {
+        "sample_count": table.c.sample_count + excluded.sample_count,
+        "batt_volt_count": table.c.batt_volt_count + excluded.batt_volt_count,
+    }
+    for m in _METRICS:
+        set_[f"{m}_min"] = func.least(table.c[f"{m}_min"], excluded[f"{m}_min"])
+        set_[f"{m}_max"] = func.greatest(table.c[f"{m}_max"], excluded[f"{m}_max"])
+        set_[f"{m}_sum"] = table.c[f"{m}_sum"] + excluded[f"{m}_sum"]
+    for column in STATUS_COLUMNS.values():
+        set_[column] = table.c[column] + excluded[column]
+    return stmt.on_conflict_do_update(index_elements=["vehicle_id", "bucket", "bucket_start"], set_=set_)
+
+
+async def flush_rollups(database, accumulator: RollupAccumulator = rollup_accumulator) -> int:
+    """Upsert semua akumulator ke telemetry_rollups. Mengembalikan jumlah baris.
+
+    Jika upsert gagal, batch yang belum tersimpan dikembalikan ke akumulator
+    sehingga ikut di flush berikutnya.
+    """
+    rows = accumulator.drain()
+    for i in range(0, len(rows), ROLLUP_BATCH_SIZE):
+        try:
+            await database.execute(_upsert_statement(rows[i:i + ROLLUP_BATCH_SIZE]))
+        except BaseException:
+            accumulator.restore(rows[i:])
+            raise
+    return len(rows)
+
+
+async def run_rollup_flusher(database, accumulator: RollupAccumulator = rollup_accumulator,
+                             interval: float = ROLLUP_FLUSH_SECONDS) -> None:
+    """Background task: flush periodik sampai di-cancel (flush terakhir saat cancel)."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await flush_rollups(database, accumulator)
+            except Exception as e:
+                print(f"Rollup flush failed: {e}")
+    finally:
+        try:
+            await flush_rollups(database, accumulator)
+        except Exception as e:
+            print(f"Final rollup flush failed: {e}")
+
+
+def format_rollup(row: Dict[str, Any]) -> Dict[str, Any]:
+    count = row["sample_count"] or 0
+    batt_count = row["batt_volt_count"] or 0
+
+    def stats(metric: str, n: int) -> Dict[str, Optional[float]]:
+        return {
+            "min": row[f"{metric}_min"],
+            "max": row[f"{metric}_max"],
+            "avg": (row[f"{metric}_sum"] / n) if n else None,
+        }
+
+    return {
+        "vehicle_id": row["vehicle_id"],
+        "bucket": row["bucket"],
+        "bucket_start": row["bucket_start"],
+        "sample_count": count,
+        "temp": stats("temp", count),
+        "rpm": stats("rpm", count),
+        "batt_volt": stats("batt_volt", batt_count),
+        "status_counts": {status: row[column] for status, column in STATUS_COLUMNS.items()},
+    }
+
+
+async def fetch_rollups(database, vehicle_id: str, bucket: str, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    table = TelemetryRollup.__table__
+    conditions = [table.c.vehicle_id == vehicle_id, table.c.bucket == bucket]
+    if start is not None:
+        conditions.append(table.c.bucket_start >= start)
+    if end is not None:
+        conditions.append(table.c.bucket_start < end)
+    query = select(table).where(and_(*conditions)).order_by(table.c.bucket_start.desc()).limit(limit)
+    rows = await database.fetch_all(query)
+    return [format_rollup(dict(r)) for r in rows]
+
+
+async def backfill_rollups(database, vehicle_id: Optional[str] = None, since: Optional[datetime] = None) -> int:
+    """Membangun ulang rollup dari telemetry_samples.
+
+    Rollup yang ada (untuk kendaraan / sejak jam ``since``) dihapus lalu
+    dihitung ulang. Penghapusan dibatasi pada rentang data mentah yang masih
+    ada: rollup per jam dari partisi yang sudah dihapus job retensi tidak bisa
+    dihitung ulang, sehingga ``since`` dinaikkan ke jam sampel tertua. Jalankan
+    saat ingest untuk rentang tersebut tidak aktif, karena akumulator live yang
+    belum di-flush akan ditambahkan di atasnya.
+    """
+    rollups = TelemetryRollup.__table__
+    samples = TelemetrySample.__table__
+    oldest = await database.fetch_val(select(func.min(samples.c.timestamp)))
+    if oldest is None:
+        return 0
+    oldest = bucket_start(oldest, "hour")
+    since = oldest if since is None else max(bucket_start(since, "hour"), oldest)
+
+    delete = rollups.delete().where(rollups.c.bucket_start >= since)
+    key = (samples.c.vehicle_id, samples.c.timestamp, samples.c.id)
+    query = select(
+        samples.c.id, samples.c.vehicle_id, samples.c.timestamp, samples.c.rpm,
+        samples.c.temp, samples.c.batt_volt, samples.c.status,
+    ).where(samples.c.timestamp >= since).order_by(*key).limit(BACKFILL_PAGE_ROWS)
+    if vehicle_id is not None:
+        delete = delete.where(rollups.c.vehicle_id == vehicle_id)
+        query = query.where(samples.c.vehicle_id == vehicle_id)
+
+    accumulator = RollupAccumulator()
+    total = 0
+    async with database.transaction():
+        await database.execute(delete)
+        # Dibaca per halaman keyset, bukan cursor iterate: upsert di tengah
+        # cursor yang masih terbuka di koneksi transaksi yang sama akan macet
+        after = None
+        while True:
+            page = query if after is None else query.where(tuple_(*key) > tuple_(*after))
+            rows = await database.fetch_all(page)
+            for r in rows:
+                accumulator.add(r["vehicle_id"], r["timestamp"], r["rpm"], r["temp"], r["batt_volt"], r["status"] or [])
+            total += len(rows)
+            # Sampel terurut per kendaraan/waktu, jadi akumulator tetap kecil jika sering di-flush
+            if len(accumulator) >= ROLLUP_BATCH_SIZE:
+                await flush_rollups(database, accumulator)
+            if len(rows) < BACKFILL_PAGE_ROWS:
+                break
+            last = rows[-1]
+            after = (last["vehicle_id"], last["timestamp"], last["id"])
+        await flush_rollups(database, accumulator)
+    return total
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="Utilitas rollup telemetry")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="Bangun ulang rollup dari telemetry_samples")
+    bf.add_argument("--vehicle-id")
+    bf.add_argument("--since", type=datetime.fromisoformat, help="ISO datetime (UTC, naive)")
+    args = parser.parse_args()
+
+    from database import database
+
+    await database.connect()
+    try:
+        if args.command == "backfill":
+            total = await backfill_rollups(database, args.vehicle_id, args.since)
+            print(f"Backfill selesai: {total} sampel diproses.")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,175 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: tidak ada flock, fitur ini khusus POSIX
+    fcntl = None
+
+from services.metrics import metrics
+
+# Path file tabel shared-memory (mis. /dev/shm/otosense_state); kosong = nonaktif
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")
+# Jumlah slot (kapasitas kendaraan); sisakan ruang agar probing tetap pendek
+SHARED_STATE_SLOTS = int(os.getenv("SHARED_STATE_SLOTS", "65536"))
+# Ukuran tetap per record (byte), termasuk header slot dan vehicle_id.
+# Record dengan ai_advice dari KB/AI umumnya 1-2 KB, jadi default 4 KB.
+SHARED_STATE_RECORD_SIZE = int(os.getenv("SHARED_STATE_RECORD_SIZE", "4096"))
+
+_MAGIC = b"OTOSHM02"
+# magic, jumlah slot, ukuran record
+_HEADER = struct.Struct("<8sII")
+_HEADER_SIZE = 64
+# seq (seqlock), panjang vehicle_id, panjang value, timestamp record (detik sejak epoch)
+_SLOT = struct.Struct("<IHHd")
+_KEY_MAX = 64
+_MAX_PROBE = 32
+_READ_RETRIES = 100
+_EPOCH = datetime(1970, 1, 1)
+_NO_TIMESTAMP = float("-inf")
+
+
+def _record_timestamp(record: Dict[str, Any]) -> float:
+    """Timestamp record sebagai detik; zona waktu diabaikan seperti kolom ``timestamp`` di database."""
+    try:
+        return (datetime.fromisoformat(record["timestamp"]).replace(tzinfo=None) - _EPOCH).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return _NO_TIMESTAMP
+
+
+class SharedStateTable:
+    """Tabel state terakhir per kendaraan di file mmap yang dibagi semua worker satu host.
+
+    Setiap slot berukuran tetap dan berisi record JSON (bentuk respons
+    ``/api/status``). Slot dipilih dari crc32 ``vehicle_id`` dengan linear
+    probing. Penulis antar proses diserialkan dengan ``flock``; pembaca tidak
+    mengambil lock, melainkan memakai seqlock: seq ganjil berarti slot sedang
+    ditulis, dan bacaan diulang jika seq berubah selama membaca. Header slot
+    menyimpan ``timestamp`` record sehingga paket lama yang diproses worker
+    lain tidak menimpa state yang lebih baru (sama dengan upsert ``telemetry``).
+    """
+
+    def __init__(self, path: str, slots: int = SHARED_STATE_SLOTS, record_size: int = SHARED_STATE_RECORD_SIZE):
+        if fcntl is None:
+            raise RuntimeError("SHARED_STATE_PATH membutuhkan sistem POSIX (fcntl/flock)")
+        if record_size <= _SLOT.size + _KEY_MAX:
+            raise ValueError(f"SHARED_STATE_RECORD_SIZE harus > {_SLOT.size + _KEY_MAX}")
+        self.path = path
+        self.slots = slots
+        self.record_size = record_size
+        self.value_max = min(record_size - _SLOT.size - _KEY_MAX, 0xFFFF)
+        size = _HEADER_SIZE + slots * record_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(self._fd).st_size
+            header = os.pread(self._fd, _HEADER.size, 0) if current >= _HEADER.size else b""
+            if current != size or header != _HEADER.pack(_MAGIC, slots, record_size):
+                if current:
+                    print(f"Shared state {path}: layout changed, table reinitialized.")
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, slots, record_size), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self._view = memoryview(self._mm)
+
+    def close(self) -> None:
+        self._view.release()
+        self._mm.close()
+        os.close(self._fd)
+
+    def _offset(self, index: int) -> int:
+        return _HEADER_SIZE + index * self.record_size
+
+    def _probe(self, key: bytes):
+        start = zlib.crc32(key) % self.slots
+        for i in range(min(_MAX_PROBE, self.slots)):
+            yield self._offset((start + i) % self.slots)
+
+    def put(self, vehicle_id: str, record: Dict[str, Any]) -> bool:
+        """Menulis record; False jika record lebih lama dari isi slot, terlalu besar, atau tidak ada slot kosong.
+
+        Record yang terlalu besar tidak disimpan, tetapi slot kendaraan itu
+        (jika ada) dikosongkan agar pembaca tidak menyajikan record lama dan
+        fallback ke database.
+        """
+        key = vehicle_id.encode("utf-8")
+        if len(key) > _KEY_MAX:
+            metrics.incr("shared_state.oversize")
+            return False
+        value = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        oversize = len(value) > self.value_max
+        if oversize:
+            metrics.incr("shared_state.oversize")
+            value = b""
+        timestamp = _record_timestamp(record)
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for off in self._probe(key):
+                seq, key_len, _, stored = _SLOT.unpack_from(self._mm, off)
+                if key_len and bytes(self._view[off + _SLOT.size:off + _SLOT.size + key_len]) != key:
+                    continue
+                if key_len and timestamp != _NO_TIMESTAMP and stored > timestamp:
+                    # Paket out-of-order (mis. diproses worker lain): jangan timpa state yang lebih baru
+                    metrics.incr("shared_state.stale")
+                    return False
+                if oversize and not key_len:
+                    # Kendaraan belum ada di tabel; tidak perlu memakai slot kosong
+                    return False
+                # seq ganjil: pembaca tahu slot sedang berubah
+                _SLOT.pack_into(self._mm, off, (seq + 1) & 0xFFFFFFFF, key_len, 0, stored)
+                body = off + _SLOT.size
+                self._mm[body:body + len(key)] = key
+                self._mm[body + _KEY_MAX:body + _KEY_MAX + len(value)] = value
+                # Panjang value 0 = tombstone: key tetap memegang slot, pembaca mendapat None
+                _SLOT.pack_into(self._mm, off, (seq + 2) & 0xFFFFFFFF, len(key), len(value), timestamp)
+                return not oversize
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if not oversize:
+            metrics.incr("shared_state.full")
+        return False
+
+    def get_bytes(self, vehicle_id: str) -> Optional[bytes]:
+        """Record JSON mentah (siap dikirim sebagai respons) atau None jika tidak ada."""
+        key = vehicle_id.encode("utf-8")
+        view = self._view
+        for off in self._probe(key):
+            body = off + _SLOT.size
+            for _ in range(_READ_RETRIES):
+                seq, key_len, value_len, _ = _SLOT.unpack_from(view, off)
+                if seq & 1:
+                    continue
+                matched = key_len == len(key) and view[body:body + key_len] == key
+                value = bytes(view[body + _KEY_MAX:body + _KEY_MAX + value_len]) if matched else None
+                if _SLOT.unpack_from(view, off)[0] == seq:
+                    break
+            else:
+                # Penulis terus aktif di slot ini; biarkan pemanggil fallback ke database
+                metrics.incr("shared_state.read_retries_exhausted")
+                return None
+            if key_len == 0:
+                return None
+            if matched:
+                # Tombstone (record terakhir terlalu besar): fallback ke database
+                return value or None
+        return None
+
+    def get(self, vehicle_id: str) -> Optional[Dict[str, Any]]:
+        data = self.get_bytes(vehicle_id)
+        return json.loads(data) if data is not None else None
+
+
+def open_shared_state() -> Optional[SharedStateTable]:
+    if not SHARED_STATE_PATH:
+        return None
+    return SharedStateTable(SHARED_STATE_PATH)
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy.sql import select
+
+from services.metrics import metrics
+
+# Jumlah baris state terakhir per query saat warm-up
+WARMUP_CHUNK_SIZE = int(os.getenv("WARMUP_CHUNK_SIZE", "1000"))
+# Setelah sekian detik service dianggap siap walau warm-up belum selesai (warm-up tetap berjalan)
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "30"))
+
+_FIELDS = (
+    "vehicle_id", "rpm", "temp", "dtc_code", "tps_percent", "batt_volt",
+    "fuel_trim_short", "o2_volt", "map_kpa", "vehicle_model",
+)
+
+
+def _json(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def record_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Baris tabel telemetry -> record dengan bentuk yang sama seperti hasil pipeline ingest."""
+    record = {k: row[k] for k in _FIELDS if row[k] is not None}
+    record["timestamp"] = row["timestamp"].isoformat()
+    # Tabel telemetry tidak menyimpan speed (sama seperti /api/status)
+    record["speed"] = 0
+    record["status"] = _json(row["status"]) or ["NORMAL"]
+    record["ai_advice"] = _json(row["ai_advice"])
+    return record
+
+
+class WarmUp:
+    """Memuat state terakhir semua kendaraan dari tabel telemetry ke ``vehicle_store``.
+
+    Baris dibaca per chunk (keyset pada ``vehicle_id``) di background task
+    sehingga startup tidak tertahan. Kendaraan yang sudah mengirim data live
+    selama warm-up tidak ditimpa. Service ditandai siap setelah warm-up
+    selesai atau setelah ``timeout`` detik.
+    """
+
+    def __init__(self, database, store: Dict[str, Dict[str, Any]],
+                 chunk_size: int = WARMUP_CHUNK_SIZE, timeout: float = WARMUP_TIMEOUT_SECONDS, shared=None):
+        self.database = database
+        self.store = store
+        self.shared = shared
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.ready = False
+        self.done = False
+        self.timed_out = False
+        self.rows = 0
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    async def load(self) -> int:
+        from database import TelemetryRecord
+
+        table = TelemetryRecord.__table__
+        last_id: Optional[str] = None
+        while True:
+            query = select(table).order_by(table.c.vehicle_id).limit(self.chunk_size)
+            if last_id is not None:
+                query = query.where(table.c.vehicle_id > last_id)
+            rows = await self.database.fetch_all(query)
+            for r in rows:
+                row = dict(r._mapping) if hasattr(r, "_mapping") else dict(r)
+                vid = row["vehicle_id"]
+                if vid in self.store:
+                    continue
+                record = self.store[vid] = record_from_row(row)
+                # Tabel shared-memory bisa sudah terisi worker lain; jangan timpa yang lebih baru
+                if self.shared is not None and self.shared.get_bytes(vid) is None:
+                    self.shared.put(vid, record)
+            self.rows += len(rows)
+            metrics.set_gauge("warmup.rows", self.rows)
+            if len(rows) < self.chunk_size:
+                return self.rows
+            last_id = rows[-1]["vehicle_id"]
+
+    async def run(self) -> None:
+        start = time.perf_counter()
+        task = asyncio.create_task(self.load())
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            self.ready = True
+            metrics.incr("warmup.timeouts")
+            print(f"Warm-up timeout after {self.timeout}s ({self.rows} rows so far); serving while loading continues.")
+            try:
+                await task
+            except Exception as e:
+                self.error = str(e)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if task.done():
+                self.done = True
+                self.ready = True
+                self.duration = time.perf_counter() - start
+                metrics.observe("warmup.duration", self.duration)
+
+        if self.error:
+            metrics.incr("warmup.errors")
+            print(f"Warm-up failed after {self.rows} rows: {self.error}")
+        else:
+            print(f"Warm-up finished: {self.rows} vehicles in {self.duration:.2f}s.")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready else "warming_up",
+            "warmup_done": self.done,
+            "warmup_timed_out": self.timed_out,
+            "warmup_rows": self.rows,
+            "warmup_seconds": round(self.duration, 3) if self.duration is not None else None,
+            "warmup_error": self.error,
+        }
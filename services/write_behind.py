@@ -0,0 +1,341 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: tanpa flock hanya satu worker yang didukung
+    fcntl = None
+
+from services.metrics import metrics
+from services.pipeline import DatabaseSink, PipelineContext
+
+# Aktifkan mode write-behind (ingest tidak menunggu database)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+# Log append-only lokal untuk durabilitas baris yang belum di-flush (satu file per worker)
+WRITE_BEHIND_LOG = os.getenv("WRITE_BEHIND_LOG", "write_behind.log")
+# Jumlah maksimum worker (slot log) per host
+WRITE_BEHIND_MAX_WORKERS = int(os.getenv("WRITE_BEHIND_MAX_WORKERS", "64"))
+# Flush setiap N milidetik ...
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+# ... atau segera setelah M baris terkumpul
+WRITE_BEHIND_BATCH_ROWS = int(os.getenv("WRITE_BEHIND_BATCH_ROWS", "1000"))
+# Batas baris yang belum tersimpan di database; jika tercapai ingest menunggu flush,
+# dan jika database belum bisa menerima, sampel baru ditolak (503)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "20000"))
+# fsync log setiap record (lebih aman terhadap mati listrik, lebih lambat)
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "0") == "1"
+
+SAMPLE_COLUMNS = (
+    "vehicle_id", "timestamp", "rpm", "speed", "temp", "dtc_code",
+    "tps_percent", "batt_volt", "fuel_trim_short", "o2_volt", "map_kpa",
+    "vehicle_model", "status", "ai_advice",
+)
+
+
+class WriteBehindFull(Exception):
+    """Buffer write-behind penuh dan flush gagal: sampel ditolak tanpa ditulis ke log."""
+
+    def __init__(self, pending: int, retry_after: int):
+        super().__init__(f"Write-behind buffer full ({pending} rows pending)")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+def _encode_row(row: Dict[str, Any]) -> str:
+    data = dict(row)
+    data["timestamp"] = row["timestamp"].isoformat()
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def _decode_row(line: str) -> Dict[str, Any]:
+    data = json.loads(line)
+    data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+    return data
+
+
+def _try_lock(path: str) -> Optional[int]:
+    """``flock`` eksklusif non-blocking pada ``<path>.lock``; fd-nya, atau None jika dipegang proses lain."""
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class WriteBehindSink:
+    """Stage persist asinkron: buffer in-memory + log lokal, di-flush batch oleh background task.
+
+    Ingest di-ack setelah baris ditulis ke log. Saat flush, segmen log aktif
+    dirotasi; segmen dihapus hanya setelah barisnya tersimpan di database,
+    sehingga ``recover`` saat startup bisa me-replay sisa segmen. Jika buffer
+    sudah ``max_pending`` baris dan database belum bisa menerima, sampel baru
+    ditolak dengan ``WriteBehindFull`` sebelum ditulis, sehingga data berisiko
+    tidak pernah melebihi ``max_pending``. Rollup ditambahkan setelah baris
+    tersimpan di database, termasuk baris hasil ``recover``.
+
+    Setiap worker menulis ke log slotnya sendiri, seperti slot snapshot
+    analitik: slot pertama yang ``flock`` file ``.lock``-nya bisa diambil,
+    dipegang selama proses hidup. Slot 0 memakai ``log_path`` apa adanya, slot
+    lain ``<nama>.<n><ext>``. ``recover`` hanya menyentuh log slot sendiri dan
+    slot yang lock-nya bisa diambil (pemiliknya sudah mati), tidak pernah log
+    worker lain yang masih hidup.
+    """
+
+    def __init__(self, database, log_path: str = WRITE_BEHIND_LOG,
+                 flush_ms: int = WRITE_BEHIND_FLUSH_MS, batch_rows: int = WRITE_BEHIND_BATCH_ROWS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, max_workers: int = WRITE_BEHIND_MAX_WORKERS):
+        self.sink = DatabaseSink(database)
+        self.database = database
+        self.base_log_path = log_path
+        self.max_workers = max(max_workers, 1) if fcntl is not None else 1
+        self.slot: Optional[int] = None
+        self.flush_interval = flush_ms / 1000
+        self.batch_rows = batch_rows
+        self.max_pending = max_pending
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._segments: List[str] = []
+        self._segment_seq = 0
+        self._log = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._slot_lock: Optional[int] = None
+        # Lock slot worker mati yang segmennya di-replay; dilepas setelah segmen itu tersimpan
+        self._adopted_locks: List[int] = []
+
+    def slot_path(self, slot: int) -> str:
+        if slot == 0:
+            return self.base_log_path
+        root, ext = os.path.splitext(self.base_log_path)
+        return f"{root}.{slot}{ext}"
+
+    @property
+    def log_path(self) -> str:
+        return self.slot_path(self.claim())
+
+    def claim(self) -> int:
+        """Mengklaim slot log pertama yang bebas untuk worker ini."""
+        if self.slot is not None:
+            return self.slot
+        if fcntl is None:
+            self.slot = 0
+            return self.slot
+        for slot in range(self.max_workers):
+            fd = _try_lock(self.slot_path(slot))
+            if fd is not None:
+                self._slot_lock = fd
+                self.slot = slot
+                return slot
+        raise RuntimeError(f"Semua {self.max_workers} slot log write-behind dipakai (WRITE_BEHIND_MAX_WORKERS)")
+
+    def release(self) -> None:
+        self._release_adopted()
+        if self._slot_lock is not None:
+            os.close(self._slot_lock)
+            self._slot_lock = None
+
+    def _slot_segments(self, slot: int) -> List[str]:
+        """Segmen rotasi slot, terurut waktu rotasi (tanpa log aktif dan file ``.lock``)."""
+        base = self.slot_path(slot)
+        suffixes = [(p, p[len(base) + 1:].split(".")) for p in glob.glob(f"{glob.escape(base)}.*")]
+        return [p for p, parts in sorted(
+            ((p, parts) for p, parts in suffixes if all(x.isdigit() for x in parts)),
+            key=lambda item: [int(x) for x in item[1]],
+        )]
+
+    def _open_log(self) -> None:
+        if self._log is None:
+            self._log = open(self.log_path, "a", encoding="utf-8")
+
+    def _rotate_log(self) -> Optional[str]:
+        """Menutup log aktif dan memindahkannya menjadi segmen yang menunggu flush."""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if not os.path.exists(self.log_path):
+            return None
+        stamp = int(time.time() * 1000)
+        while True:
+            # Segmen dari pemilik slot sebelumnya bisa bernama sama (seq mulai dari 1 per proses)
+            self._segment_seq += 1
+            segment = f"{self.log_path}.{stamp}.{self._segment_seq}"
+            if not os.path.exists(segment):
+                break
+        os.replace(self.log_path, segment)
+        return segment
+
+    async def __call__(self, ctx: PipelineContext) -> None:
+        if len(self._buffer) >= self.max_pending:
+            # Batas data berisiko tercapai: tahan ingest sampai database menyusul
+            metrics.incr("write_behind.backpressure")
+            try:
+                await self.flush()
+            except Exception:
+                pass
+            if len(self._buffer) >= self.max_pending:
+                metrics.incr("write_behind.rejected")
+                raise WriteBehindFull(len(self._buffer), max(1, round(self.flush_interval)))
+
+        row = self.sink.sample_row(ctx)
+        self._open_log()
+        self._log.write(_encode_row(row))
+        self._log.flush()
+        if WRITE_BEHIND_FSYNC:
+            os.fsync(self._log.fileno())
+
+        self._buffer.append(row)
+        metrics.set_gauge("write_behind.pending_rows", len(self._buffer))
+        if len(self._buffer) >= self.batch_rows:
+            self._wake.set()
+
+    async def _copy_samples(self, rows: List[Dict[str, Any]]) -> None:
+        records = [
+            tuple(
+                json.dumps(row[c], ensure_ascii=False) if c in ("status", "ai_advice") and row[c] is not None else row[c]
+                for c in SAMPLE_COLUMNS
+            )
+            for row in rows
+        ]
+        async with self.database.connection() as connection:
+            raw = connection.raw_connection
+            if hasattr(raw, "copy_records_to_table"):
+                await raw.copy_records_to_table(
+                    self.sink.samples_table.name, records=records, columns=list(SAMPLE_COLUMNS)
+                )
+                return
+        # Driver tanpa COPY: insert multi-baris
+        for i in range(0, len(rows), self.batch_rows):
+            await self.database.execute(self.sink.samples_table.insert().values(rows[i:i + self.batch_rows]))
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        # State terakhir: satu baris per kendaraan, timestamp terbaru menang (paket out-of-order diabaikan)
+        latest: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            prev = latest.get(row["vehicle_id"])
+            if prev is None or row["timestamp"] >= prev["timestamp"]:
+                latest[row["vehicle_id"]] = {k: v for k, v in row.items() if k != "speed"}
+        latest_rows = list(latest.values())
+        async with self.database.transaction():
+            await self._copy_samples(rows)
+            for i in range(0, len(latest_rows), self.batch_rows):
+                await self.database.execute(self.sink.upsert_latest(latest_rows[i:i + self.batch_rows]))
+
+    async def flush(self) -> int:
+        async with self._lock:
+            rows, self._buffer = self._buffer, []
+            segment = self._rotate_log()
+            if segment:
+                self._segments.append(segment)
+            if not rows:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                await self._write(rows)
+            except Exception as e:
+                # Kembalikan ke depan buffer; segmen log tetap disimpan untuk recovery
+                self._buffer[:0] = rows
+                metrics.incr("write_behind.flush_errors")
+                print(f"Write-behind flush failed ({len(rows)} rows pending): {e}")
+                raise
+            finally:
+                metrics.set_gauge("write_behind.pending_rows", len(self._buffer))
+
+            for row in rows:
+                self.sink.rollups.add(
+                    row["vehicle_id"], row["timestamp"], row["rpm"], row["temp"], row["batt_volt"], row["status"] or []
+                )
+            metrics.observe("write_behind.flush", time.perf_counter() - start)
+            metrics.incr("write_behind.flushed_rows", len(rows))
+            for seg in self._segments:
+                try:
+                    os.remove(seg)
+                except FileNotFoundError:
+                    pass
+            self._segments.clear()
+            self._release_adopted()
+            return len(rows)
+
+    def _release_adopted(self) -> None:
+        for fd in self._adopted_locks:
+            os.close(fd)
+        self._adopted_locks.clear()
+
+    async def recover(self) -> int:
+        """Me-replay log yang tersisa dari proses sebelumnya ke database.
+
+        Mencakup slot worker ini dan slot worker lain yang lock-nya bisa
+        diambil (prosesnya sudah mati); log worker yang masih hidup dilewati.
+        """
+        own = self.claim()
+        paths = self._slot_segments(own)
+        segment = self._rotate_log()
+        if segment:
+            paths.append(segment)
+        for slot in range(self.max_workers):
+            if slot == own:
+                continue
+            base = self.slot_path(slot)
+            if not os.path.exists(base) and not self._slot_segments(slot):
+                continue
+            fd = _try_lock(base)
+            if fd is None:
+                # Worker lain masih hidup dan menulis ke slot ini
+                continue
+            self._adopted_locks.append(fd)
+            paths.extend(self._slot_segments(slot))
+            if os.path.exists(base):
+                paths.append(base)
+        rows: List[Dict[str, Any]] = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rows.append(_decode_row(line))
+                    except Exception as e:
+                        # Baris terakhir bisa terpotong jika proses mati saat menulis
+                        print(f"Write-behind log line skipped in {path}: {e}")
+        if not rows:
+            for path in paths:
+                os.remove(path)
+            self._release_adopted()
+            return 0
+        async with self._lock:
+            self._segments.extend(paths)
+            self._buffer[:0] = rows
+        await self.flush()
+        print(f"Write-behind recovery: {len(rows)} rows replayed from {len(paths)} log segment(s).")
+        return len(rows)
+
+    async def run(self) -> None:
+        """Background flusher sampai di-cancel (flush terakhir saat cancel)."""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                try:
+                    await self.flush()
+                except Exception:
+                    await asyncio.sleep(self.flush_interval)
+        finally:
+            try:
+                await self.flush()
+            except Exception:
+                pass
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self.release()